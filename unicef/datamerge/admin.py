@@ -1,8 +1,31 @@
 from django.contrib import admin
-from .models import Colegio, Encuesta, EncuestaResult
+from .models import Colegio, Encuesta, EncuestaResult, LatestEncuestaResult, Job
+from .utils import refresh_latest_encuesta_results
+
+
+@admin.register(EncuestaResult)
+class EncuestaResultAdmin(admin.ModelAdmin):
+    # Result deletes send no signal, see signals.py
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_latest_encuesta_results([obj.encuesta_id])
+
+    def delete_queryset(self, request, queryset):
+        encuestas = set(queryset.values_list("encuesta", flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_latest_encuesta_results(encuestas)
 
-admin.site.register(Colegio)
-admin.site.register(Encuesta)
-admin.site.register(EncuestaResult)
 
+@admin.register(LatestEncuestaResult)
+class LatestEncuestaResultAdmin(admin.ModelAdmin):
+    # Derived from EncuestaResult, edit the results instead
+    def has_add_permission(self, request):
+        return False
 
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(Colegio)
+admin.site.register(Encuesta)
+admin.site.register(Job)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DatamergeConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "unicef.datamerge"
+
+    def ready(self):
+        # Connect the receivers that bump the report data version
+        from . import signals  # noqa: F401
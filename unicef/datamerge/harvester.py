@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+from django.db.models import F, Max, Min, Q
+from django.utils import timezone
+
+from .models import EncuestaResult, current_day
+
+API_LIMESURVEY = os.getenv("API_LIMESURVEY")
+INTERNAL_LS_USER = os.getenv("INTERNAL_LS_USER")
+INTERNAL_LS_PASS = os.getenv("INTERNAL_LS_PASS")
+
+# Harvest tuning, overridable from the environment or per run
+HARVEST_CONCURRENCY = int(os.getenv("HARVEST_CONCURRENCY", "20"))
+HARVEST_TIMEOUT = float(os.getenv("HARVEST_TIMEOUT", "30"))
+HARVEST_RETRIES = int(os.getenv("HARVEST_RETRIES", "3"))
+HARVEST_BACKOFF = float(os.getenv("HARVEST_BACKOFF", "1.0"))
+
+# Incremental mode: surveys flat for this many days are polled less often,
+# doubling the interval up to HARVEST_MAX_INTERVAL days
+HARVEST_FLAT_DAYS = int(os.getenv("HARVEST_FLAT_DAYS", "3"))
+HARVEST_MAX_INTERVAL = int(os.getenv("HARVEST_MAX_INTERVAL", "7"))
+
+# HTTP status codes worth retrying, anything else is a permanent error
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _is_retryable(ex):
+    if isinstance(ex, httpx.HTTPStatusError):
+        return ex.response.status_code in RETRY_STATUS_CODES
+    return isinstance(ex, httpx.TransportError)
+
+
+async def fetch_encuesta_data(client, semaphore, sid, retries, backoff, metrics=None):
+    """Fetch the LimeSurvey data of a single survey, retrying transient errors.
+
+    Args:
+        client (httpx.AsyncClient): Shared client holding the keep-alive connection pool.
+        semaphore (asyncio.Semaphore): Limits the number of requests in flight.
+        sid (str): Survey id.
+        retries (int): Retries after the first attempt.
+        backoff (float): Base delay in seconds, doubled on every retry and jittered.
+        metrics (RunMetrics, optional): Told the time spent in requests, the
+            retries and the final error of the survey.
+
+    Returns:
+        dict: The decoded JSON response.
+    """
+    payload = {"sid": sid, "usr": INTERNAL_LS_USER, "pass": INTERNAL_LS_PASS}
+    latency = 0.0
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                start = time.monotonic()
+                try:
+                    response = await client.post(API_LIMESURVEY, data=payload)
+                finally:
+                    latency += time.monotonic() - start
+            response.raise_for_status()
+            data = response.json()
+            if metrics is not None:
+                metrics.observe_harvest(sid, latency, attempt)
+            return data
+        except (httpx.HTTPError, ValueError) as ex:
+            if attempt == retries or not _is_retryable(ex):
+                if metrics is not None:
+                    metrics.observe_harvest(sid, latency, attempt, ex)
+                raise
+            # Full jitter so retries from many surveys do not line up
+            delay = random.uniform(0, backoff * 2**attempt)
+            logging.warning(
+                f"fetch_encuesta_data. sid {sid} attempt {attempt + 1} failed ({ex}), retrying in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+
+async def harvest(sids, concurrency, timeout, retries, backoff, metrics=None):
+    """Fetch the data of every sid concurrently over one connection pool.
+
+    Returns:
+        dict: sid -> decoded JSON response, or the exception raised for that sid.
+    """
+    sids = list(sids)
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(
+        limits=limits, timeout=timeout, verify=False
+    ) as client:
+        responses = await asyncio.gather(
+            *(
+                fetch_encuesta_data(
+                    client, semaphore, sid, retries, backoff, metrics=metrics
+                )
+                for sid in sids
+            ),
+            return_exceptions=True,
+        )
+    return dict(zip(sids, responses))
+
+
+def harvest_encuestas(
+    sids, concurrency=None, timeout=None, retries=None, backoff=None, metrics=None
+):
+    """Synchronous entry point to fetch the LimeSurvey data of many surveys.
+
+    Args:
+        sids (iterable): Survey ids, duplicates are fetched once.
+        concurrency (int, optional): Maximum requests in flight. Defaults to HARVEST_CONCURRENCY.
+        timeout (float, optional): Per request timeout in seconds. Defaults to HARVEST_TIMEOUT.
+        retries (int, optional): Retries per survey. Defaults to HARVEST_RETRIES.
+        backoff (float, optional): Base backoff delay in seconds. Defaults to HARVEST_BACKOFF.
+        metrics (RunMetrics, optional): Collects the latency, retries and errors of every survey.
+
+    Returns:
+        dict: sid -> decoded JSON response, or the exception raised for that sid.
+    """
+    unique_sids = list(dict.fromkeys(sids))
+    logging.info(f"harvest_encuestas. fetching {len(unique_sids)} surveys")
+    results = asyncio.run(
+        harvest(
+            unique_sids,
+            concurrency=concurrency or HARVEST_CONCURRENCY,
+            timeout=timeout or HARVEST_TIMEOUT,
+            retries=HARVEST_RETRIES if retries is None else retries,
+            backoff=HARVEST_BACKOFF if backoff is None else backoff,
+            metrics=metrics,
+        )
+    )
+    failed = sum(isinstance(result, Exception) for result in results.values())
+    logging.info(
+        f"harvest_encuestas. fetched {len(results) - failed} surveys, {failed} failed"
+    )
+    return results
+
+
+def select_encuestas_to_poll(
+    encuestas, flat_days=None, max_interval=None, now=None
+):
+    """Split encuestas into the ones that can still change and the ones to skip.
+
+    Surveys without results are always polled. Inactive surveys and surveys
+    whose fecha_fin is in the past are polled every ``max_interval`` days, so
+    a survey reopened or extended in LimeSurvey is noticed; the poll refreshes
+    their activa and fecha_fin. The rest are polled on every run while they
+    changed in the last ``flat_days`` days; after that they are polled every
+    2, 4, ... days (capped at ``max_interval``). Intervals count from the date
+    of the LatestEncuestaResult, which is the last time a survey was polled.
+
+    Args:
+        encuestas (list): Encuesta objects.
+        flat_days (int, optional): Days without changes before backing off. Defaults to HARVEST_FLAT_DAYS.
+        max_interval (int, optional): Maximum days between polls. Defaults to HARVEST_MAX_INTERVAL.
+        now (datetime, optional): Reference time. Defaults to timezone.now().
+
+    Returns:
+        tuple: (encuestas to poll, encuestas skipped)
+    """
+    flat_days = flat_days or HARVEST_FLAT_DAYS
+    max_interval = max_interval or HARVEST_MAX_INTERVAL
+    now = now or timezone.now()
+
+    skipped = []
+    # Date of the last stored result that differs from the latest one, in one query
+    unchanged = Q(
+        encuestas_cubiertas=F("encuesta__latest_result__encuestas_cubiertas"),
+        encuestas_incompletas=F("encuesta__latest_result__encuestas_incompletas"),
+        encuestas_totales=F("encuesta__latest_result__encuestas_totales"),
+    )
+    history = {
+        row["encuesta"]: row
+        for row in EncuestaResult.objects.filter(
+            encuesta__in=[encuesta.pk for encuesta in encuestas]
+        )
+        .values("encuesta")
+        .annotate(
+            last_polled=Max("encuesta__latest_result__date"),
+            first_seen=Min("date"),
+            last_changed=Max("date", filter=~unchanged),
+        )
+    }
+
+    to_poll = []
+    for encuesta in encuestas:
+        row = history.get(encuesta.pk)
+        if row is None or row["last_polled"] is None:
+            to_poll.append(encuesta)
+            continue
+        # Compare calendar days so a fixed daily schedule is not off by one
+        today = current_day(now)
+        expired = encuesta.fecha_fin and encuesta.fecha_fin < now
+        if encuesta.activa == "N" or expired:
+            interval = max_interval
+        else:
+            flat_for = (
+                today - current_day(row["last_changed"] or row["first_seen"])
+            ).days
+            if flat_for < flat_days:
+                to_poll.append(encuesta)
+                continue
+            interval = min(2 ** (flat_for // flat_days), max_interval)
+        if (today - current_day(row["last_polled"])).days >= interval:
+            to_poll.append(encuesta)
+        else:
+            skipped.append(encuesta)
+
+    logging.info(
+        f"select_encuestas_to_poll. polling {len(to_poll)} of {len(to_poll) + len(skipped)} surveys"
+    )
+    return to_poll, skipped
@@ -0,0 +1,217 @@
+import csv
+import logging
+import re
+from io import StringIO
+
+from django.db import transaction
+
+from .harvester import harvest_encuestas
+from .models import Colegio
+from .report_cache import bump_data_version
+from .reports import LEVELS
+from .utils import bulk_upsert_encuestas, encuesta_defaults
+
+# Dictionary of words to translate in the CCAA of the new cocina format
+CCAA_TRANSLATIONS = {
+    "ANDALUCIA": "ANDALUCÍA",
+    "CASTILLA LEON": "CASTILLA LEÓN",
+    "PAIS VASCO": "PAÍS VASCO",
+}
+
+MISSING_PARAMETERS = "Missing parameters for one or more colegios"
+
+
+def _read_rows(text):
+    return csv.DictReader(StringIO(text))
+
+
+def _sid_from_url(url):
+    match = re.search(r"sid=(\d{6})", url) if url else None
+    return match.group(1) if match else None
+
+
+def parse_cocina_old(text):
+    """Parse a cocina CSV in the old format, one row per colegio and level.
+
+    Args:
+        text (str): CSV content with the columns AN, CCAA, SSID, ID DE CENTRO, URL and TIPOLOGIA.
+
+    Returns:
+        list: Dicts with cid, nombre, comunidad_autonoma and sids, a dict of
+            Colegio encuesta field -> sid, in file order.
+
+    Raises:
+        ValueError: If any row misses a parameter. Nothing is imported then.
+    """
+    rows = []
+    for row in _read_rows(text):
+        cid, _, nivel = row["ID DE CENTRO"].partition(" - ")
+        # remove all letter P, D and S contained in the string
+        cid = re.sub(r"[PDS]", "", cid)
+        if not all(
+            [cid, row["AN"], row["CCAA"], row["SSID"], row["URL"], row["TIPOLOGIA"]]
+        ):
+            raise ValueError(MISSING_PARAMETERS)
+        rows.append(
+            {
+                "cid": cid,
+                "nombre": row["AN"],
+                "comunidad_autonoma": row["CCAA"],
+                "sids": {
+                    field: row["SSID"] for field, label in LEVELS if label in nivel
+                },
+            }
+        )
+    return rows
+
+
+def parse_cocina_new(text):
+    """Parse a cocina CSV in the new format, one row per colegio with its three encuestas.
+
+    Args:
+        text (str): CSV content with the columns CENTRO, CA, Codigo interno,
+            PRIMARIA, SECUNDARIA and PROFESORADO.
+
+    Returns:
+        list: Dicts as returned by parse_cocina_old(), with the three sids set.
+
+    Raises:
+        ValueError: If any row misses a parameter. Nothing is imported then.
+    """
+    rows = []
+    for row in _read_rows(text):
+        comunidad_autonoma = CCAA_TRANSLATIONS.get(row["CA"], row["CA"])
+
+        # Extract the relevant part of the cod_cid and remove extra characters and whitespace
+        cod_cid = row["Codigo interno"]
+        cid_match = re.search(r"L2A[D]?\d{3}", cod_cid)
+        cid = cid_match.group(0).replace("D", "") if cid_match else cod_cid.strip()
+
+        sids = {
+            "pri_sid": _sid_from_url(row["PRIMARIA"]),
+            "sec_sid": _sid_from_url(row["SECUNDARIA"]),
+            "pro_sid": _sid_from_url(row["PROFESORADO"]),
+        }
+        if not all([row["CENTRO"], comunidad_autonoma, *sids.values()]):
+            raise ValueError(MISSING_PARAMETERS)
+        rows.append(
+            {
+                "cid": cid,
+                "nombre": row["CENTRO"],
+                "comunidad_autonoma": comunidad_autonoma,
+                "sids": sids,
+            }
+        )
+    return rows
+
+
+def exclude_existing_colegios(rows):
+    """Drop the rows whose cid is already in the database, checked with one query."""
+    existing = set(
+        Colegio.objects.filter(cid__in={row["cid"] for row in rows}).values_list(
+            "cid", flat=True
+        )
+    )
+    return [row for row in rows if row["cid"] not in existing]
+
+
+def fetch_encuestas(sids, concurrency=None):
+    """Create or refresh the Encuesta of every sid from LimeSurvey.
+
+    Each distinct sid is fetched once, concurrently through the harvester,
+    and the Encuesta rows are then upserted in bulk.
+
+    Args:
+        sids (iterable): Survey ids, empty values are ignored.
+        concurrency (int, optional): Maximum requests in flight. Defaults to HARVEST_CONCURRENCY.
+
+    Returns:
+        dict: sid -> Encuesta. Sids that could not be fetched are left out.
+    """
+    responses = harvest_encuestas(
+        [sid for sid in sids if sid], concurrency=concurrency
+    )
+    encuestas_data = {}
+    for sid, data_externa in responses.items():
+        if isinstance(data_externa, Exception):
+            logging.error(f"Error updating encuesta for SSID {sid}: {data_externa}")
+            continue
+        try:
+            encuestas_data[sid] = encuesta_defaults(data_externa)
+        except (KeyError, TypeError) as e:
+            logging.error(f"Invalid LimeSurvey data for SSID {sid}: {e}")
+    return bulk_upsert_encuestas(encuestas_data)
+
+
+def import_colegios(rows, encuestas, update_existing=True):
+    """Create or update the Colegio of every row with bulk queries in one transaction.
+
+    Existing colegios are loaded with a single query keyed by cid. Rows are
+    applied in file order, so several rows of the same cid add up to one
+    Colegio. Rows with an encuesta missing from ``encuestas`` are skipped.
+
+    Args:
+        rows (list): As returned by parse_cocina_old() or parse_cocina_new().
+        encuestas (dict): sid -> Encuesta, as returned by fetch_encuestas().
+        update_existing (bool): Update colegios already stored, setting only
+            the encuestas of each row. When False, rows whose cid is stored
+            or was created by an earlier row are skipped.
+
+    Returns:
+        list: The Colegio of every imported row, in file order.
+    """
+    with transaction.atomic():
+        existing = {}
+        for colegio in Colegio.objects.filter(
+            cid__in={row["cid"] for row in rows}
+        ).order_by("pk"):
+            existing.setdefault(colegio.cid, colegio)
+
+        to_create = {}
+        to_update = {}
+        imported = []
+        for row in rows:
+            cid = row["cid"]
+            if not update_existing and (cid in existing or cid in to_create):
+                logging.debug(
+                    f"import_colegios. colegio {row['nombre']} with cid {cid} already exists. Skipping"
+                )
+                continue
+            missing = [sid for sid in row["sids"].values() if sid not in encuestas]
+            if missing:
+                logging.error(
+                    f"import_colegios. skipping colegio {row['nombre']} with cid {cid}, encuestas {missing} not available"
+                )
+                continue
+
+            colegio = existing.get(cid) or to_create.get(cid)
+            if colegio is None:
+                colegio = to_create[cid] = Colegio(cid=cid)
+            elif colegio.pk is not None:
+                to_update[cid] = colegio
+            colegio.nombre = row["nombre"]
+            colegio.comunidad_autonoma = row["comunidad_autonoma"]
+            colegio.telefono = colegio.telefono or ""
+            colegio.email = colegio.email or ""
+            for field, sid in row["sids"].items():
+                setattr(colegio, field, encuestas[sid])
+            imported.append(colegio)
+
+        Colegio.objects.bulk_create(to_create.values(), batch_size=500)
+        Colegio.objects.bulk_update(
+            to_update.values(),
+            [
+                "nombre",
+                "comunidad_autonoma",
+                "telefono",
+                "email",
+                *(field for field, _ in LEVELS),
+            ],
+            batch_size=500,
+        )
+        bump_data_version()
+
+    logging.info(
+        f"import_colegios. {len(imported)} of {len(rows)} rows imported: {len(to_create)} colegios created, {len(to_update)} updated"
+    )
+    return imported
@@ -0,0 +1,233 @@
+import logging
+import os
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from django.db import close_old_connections, transaction
+from django.test import RequestFactory
+from django.utils import timezone
+
+from .locks import RUN_LOCK_TTL
+from .models import Job, RunLock
+
+# Seconds the worker sleeps when the queue is empty
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+# Seconds after which a running job is taken for dead, as its worker died or was killed
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", str(RUN_LOCK_TTL)))
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register the decorated function as the handler of the jobs of a kind.
+
+    Handlers receive the Job and return a JSON serializable result.
+    """
+
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+def enqueue(kind, payload=None, dedupe=False):
+    """Queue a job to be run by the run_jobs worker.
+
+    Args:
+        kind (str): Registered job kind.
+        payload (dict, optional): JSON serializable arguments of the job.
+        dedupe (bool): Return the queued or running job of the same kind, if
+            any, instead of queueing another one.
+
+    Returns:
+        tuple: (job, created)
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    if not dedupe:
+        job = Job.objects.create(kind=kind, payload=payload or {})
+        logging.info(f"enqueue. {job} queued")
+        return job, True
+
+    lock_name = f"enqueue:{kind}"[:50]
+    RunLock.objects.get_or_create(name=lock_name)
+    with transaction.atomic():
+        # Write the lock row of the kind first: concurrent enqueues wait here
+        # for this transaction, so only one of them queues a job
+        now = timezone.now()
+        RunLock.objects.filter(name=lock_name).update(last_started=now)
+        fail_stale_jobs(kind, now=now)
+        job = (
+            Job.objects.filter(kind=kind, status__in=[Job.QUEUED, Job.RUNNING])
+            .order_by("created_at")
+            .first()
+        )
+        if job is not None:
+            logging.info(f"enqueue. {job} already in flight")
+            return job, False
+        job = Job.objects.create(kind=kind, payload=payload or {})
+    logging.info(f"enqueue. {job} queued")
+    return job, True
+
+
+def fail_stale_jobs(kind=None, now=None):
+    """Mark as failed the jobs running for more than JOB_STALE_AFTER seconds.
+
+    Their worker is taken for dead, so they no longer block enqueue(dedupe=True).
+
+    Args:
+        kind (str, optional): Only fail the jobs of this kind.
+        now (datetime, optional): Reference time. Defaults to timezone.now().
+
+    Returns:
+        int: Number of jobs failed.
+    """
+    now = now or timezone.now()
+    jobs = Job.objects.filter(
+        status=Job.RUNNING, started_at__lt=now - timedelta(seconds=JOB_STALE_AFTER)
+    )
+    if kind is not None:
+        jobs = jobs.filter(kind=kind)
+    failed = jobs.update(
+        status=Job.FAILED,
+        message=f"Running for more than {JOB_STALE_AFTER:.0f}s, the worker is taken for dead",
+        finished_at=now,
+    )
+    if failed:
+        logging.warning(f"fail_stale_jobs. failed {failed} stale jobs")
+    return failed
+
+
+def report_progress(job, progress, message=""):
+    """Store the progress, in percent, of a running job."""
+    job.progress = progress
+    job.message = message[:200]
+    Job.objects.filter(pk=job.pk).update(progress=job.progress, message=job.message)
+
+
+def claim_next_job():
+    """Mark the oldest queued job as running and return it, or None if the queue is empty.
+
+    The claim is a conditional update, so several workers never run the same job.
+    """
+    for pk in Job.objects.filter(status=Job.QUEUED).order_by("created_at").values_list(
+        "pk", flat=True
+    )[:10]:
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, started_at=timezone.now()
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job with its handler and store its result or error.
+
+    The outcome is only stored while the job is still running, so a job
+    failed meanwhile by fail_stale_jobs() is not overwritten.
+    """
+    logging.info(f"run_job. running {job}")
+    try:
+        job.result = JOB_HANDLERS[job.kind](job)
+        job.status = Job.DONE
+        job.progress = 100
+    except Exception as ex:
+        logging.exception(f"run_job. {job} failed")
+        job.status = Job.FAILED
+        job.message = str(ex)[:200]
+        job.error = traceback.format_exc()
+    job.finished_at = timezone.now()
+    saved = Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+        status=job.status,
+        progress=job.progress,
+        message=job.message,
+        result=job.result,
+        error=job.error,
+        finished_at=job.finished_at,
+    )
+    if not saved:
+        logging.warning(f"run_job. {job} is no longer running, its outcome is dropped")
+        job.refresh_from_db()
+        return job
+    logging.info(f"run_job. {job} finished in {job.finished_at - job.started_at}")
+    return job
+
+
+def run_worker(once=False, poll_interval=None):
+    """Run queued jobs one after another.
+
+    Args:
+        once (bool): Return when the queue is empty instead of polling for new jobs.
+        poll_interval (float, optional): Seconds between polls. Defaults to JOB_POLL_INTERVAL.
+
+    Returns:
+        int: Number of jobs run.
+    """
+    poll_interval = JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    count = 0
+    while True:
+        # Long running worker: drop connections that died or expired between jobs
+        close_old_connections()
+        job = claim_next_job()
+        if job is None:
+            if once:
+                return count
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        count += 1
+
+
+@job_handler("update_encuestas_results")
+def update_encuestas_results_job(job):
+    # Import the views here to avoid circular import
+    from .views import update_encuestas_results
+
+    request = RequestFactory().get("/", job.payload)
+    response = update_encuestas_results(
+        request, progress=lambda progress, message: report_progress(job, progress, message)
+    )
+    detail = response.content.decode("utf-8")
+    if not 200 <= response.status_code < 300:
+        raise RuntimeError(f"{response.status_code} {detail}")
+    return {"detail": detail}
+
+
+@job_handler("update_only_csvs")
+def update_only_csvs_job(job):
+    from .views import publish_reports
+
+    # Start of the update, for the elapsed time in last_update.csv
+    start_time = datetime.now()
+    publish_reports(RequestFactory().get("/"), start_time)
+    return {"detail": "CSV files updated"}
+
+
+def _import_cocina(job, parse, update_existing):
+    from .importers import exclude_existing_colegios, fetch_encuestas, import_colegios
+
+    rows = parse(job.payload["content"])
+    if not update_existing:
+        rows = exclude_existing_colegios(rows)
+    report_progress(job, 10, f"Fetching encuestas of {len(rows)} rows")
+    encuestas = fetch_encuestas(sid for row in rows for sid in row["sids"].values())
+    report_progress(job, 80, "Importing colegios")
+    colegios = import_colegios(rows, encuestas, update_existing=update_existing)
+    return {"imported": len(colegios), "cids": sorted({c.cid for c in colegios})}
+
+
+@job_handler("cocina_csv_old")
+def cocina_csv_old_job(job):
+    from .importers import parse_cocina_old
+
+    return _import_cocina(job, parse_cocina_old, update_existing=True)
+
+
+@job_handler("cocina_csv_new")
+def cocina_csv_new_job(job):
+    from .importers import parse_cocina_new
+
+    return _import_cocina(job, parse_cocina_new, update_existing=False)
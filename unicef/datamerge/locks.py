@@ -0,0 +1,118 @@
+import logging
+import os
+import time
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import RunLock
+
+# Seconds a trigger waits for the run in flight before giving up
+RUN_LOCK_WAIT = float(os.getenv("RUN_LOCK_WAIT", "3600"))
+# Seconds between attempts to take a busy lock
+RUN_LOCK_POLL = float(os.getenv("RUN_LOCK_POLL", "5"))
+# Seconds after which a lock row left by a dead process is taken over
+RUN_LOCK_TTL = float(os.getenv("RUN_LOCK_TTL", str(6 * 3600)))
+
+
+class RunLockTimeout(Exception):
+    pass
+
+
+def _advisory_key(name):
+    return zlib.crc32(name.encode("utf-8"))
+
+
+def acquire_run_lock(name):
+    """Try to take the lock of a task without blocking.
+
+    On PostgreSQL this is a session advisory lock, released by the database
+    if the process dies. Other backends use a conditional update of the
+    RunLock row, which expires after RUN_LOCK_TTL seconds.
+
+    Returns:
+        str: Token to release the lock with, or None if it is held elsewhere.
+    """
+    RunLock.objects.get_or_create(name=name)
+    token = uuid.uuid4().hex
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [_advisory_key(name)])
+            acquired = cursor.fetchone()[0]
+        if acquired:
+            RunLock.objects.filter(name=name).update(holder=token)
+        return token if acquired else None
+
+    now = timezone.now()
+    acquired = (
+        RunLock.objects.filter(name=name)
+        .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+        .update(holder=token, locked_until=now + timedelta(seconds=RUN_LOCK_TTL))
+    )
+    return token if acquired else None
+
+
+def release_run_lock(name, token):
+    RunLock.objects.filter(name=name, holder=token).update(holder="", locked_until=None)
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [_advisory_key(name)])
+
+
+def run_exclusive(name, func, *args, wait=None, **kwargs):
+    """Run a task unless another process is already running it.
+
+    When the lock is busy the trigger waits for the run in flight. Once the
+    lock is free, if a run that started after this trigger was requested has
+    finished, the trigger joins it instead of running the task again, so any
+    number of concurrent triggers coalesce into the run in flight plus at
+    most one more.
+
+    Args:
+        name (str): Name of the task, one lock per name.
+        func (callable): Task, called with the remaining arguments.
+        wait (float, optional): Seconds to wait for the lock, 0 to join the run
+            in flight without waiting. Defaults to RUN_LOCK_WAIT.
+
+    Returns:
+        tuple: (ran, result). ran is False when the trigger joined another run.
+
+    Raises:
+        RunLockTimeout: If the lock is still busy after waiting.
+    """
+    wait = RUN_LOCK_WAIT if wait is None else wait
+    requested_at = timezone.now()
+    deadline = time.monotonic() + wait
+    while True:
+        token = acquire_run_lock(name)
+        if token is not None:
+            break
+        if wait == 0:
+            logging.info(f"run_exclusive. {name} already running, joining it")
+            return False, None
+        if time.monotonic() >= deadline:
+            raise RunLockTimeout(f"{name} still running after {wait} seconds")
+        logging.info(f"run_exclusive. {name} already running, waiting")
+        time.sleep(RUN_LOCK_POLL)
+
+    try:
+        lock = RunLock.objects.get(name=name)
+        if (
+            lock.last_started
+            and lock.last_finished
+            and requested_at <= lock.last_started <= lock.last_finished
+        ):
+            logging.info(
+                f"run_exclusive. {name} already ran at {lock.last_started}, joining it"
+            )
+            return False, None
+        RunLock.objects.filter(name=name).update(last_started=timezone.now())
+        result = func(*args, **kwargs)
+        RunLock.objects.filter(name=name).update(last_finished=timezone.now())
+        return True, result
+    finally:
+        release_run_lock(name, token)
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = "Check that the configured database accepts connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default="default", help="Database alias to check"
+        )
+
+    def handle(self, *args, **kwargs):
+        connection = connections[kwargs["database"]]
+        settings_dict = connection.settings_dict
+        target = f"{connection.vendor} {settings_dict.get('HOST') or settings_dict['NAME']}"
+        start = time.monotonic()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except Exception as ex:
+            raise CommandError(f"Database {target} unreachable: {ex}")
+        elapsed = (time.monotonic() - start) * 1000
+        self.stdout.write(
+            self.style.SUCCESS(f"Database {target} reachable in {elapsed:.1f} ms")
+        )
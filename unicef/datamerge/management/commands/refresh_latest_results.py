@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+
+class Command(BaseCommand):
+    help = "Rebuild LatestEncuestaResult from the stored EncuestaResult rows"
+
+    def handle(self, *args, **kwargs):
+        logging.info("Starting refresh_latest_results command")
+
+        from unicef.datamerge.utils import refresh_latest_encuesta_results
+
+        refresh_latest_encuesta_results()
+        logging.info("Finished refresh_latest_results command")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+
+class Command(BaseCommand):
+    help = "Run the queued background jobs: results updates, CSV updates and cocina imports"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when the queue is empty instead of waiting for new jobs",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            help="Seconds to wait between polls of an empty queue",
+        )
+
+    def handle(self, *args, **kwargs):
+        from unicef.datamerge.jobs import run_worker
+
+        logging.info("Starting run_jobs worker")
+        count = run_worker(once=kwargs["once"], poll_interval=kwargs["poll_interval"])
+        logging.info(f"Finished run_jobs worker, {count} jobs run")
@@ -8,14 +8,53 @@ logging.basicConfig(level=logging.INFO)
 class Command(BaseCommand):
     help = "Update Encuesta results daily"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Maximum number of LimeSurvey requests in flight",
+        )
+        parser.add_argument(
+            "--timeout", type=float, help="Per request timeout in seconds"
+        )
+        parser.add_argument(
+            "--retries", type=int, help="Retries per survey on transient errors"
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Poll inactive or expired surveys every --max-interval days and back off on surveys without changes",
+        )
+        parser.add_argument(
+            "--flat-days",
+            type=int,
+            help="Days without changes before a survey is polled less often",
+        )
+        parser.add_argument(
+            "--max-interval", type=int, help="Maximum days between polls of a survey"
+        )
+
     def handle(self, *args, **kwargs):
         logging.info("Starting update_encuestas_results command")
 
         # Import the function inside the handle method to avoid circular import
         from unicef.datamerge.views import update_encuestas_results
 
+        params = {
+            name: kwargs[name]
+            for name in (
+                "concurrency",
+                "timeout",
+                "retries",
+                "flat_days",
+                "max_interval",
+            )
+            if kwargs[name] is not None
+        }
+        if kwargs["incremental"]:
+            params["mode"] = "incremental"
         factory = RequestFactory()
-        request = factory.get("/")
+        request = factory.get("/", params)
 
         update_encuestas_results(request)
         logging.info("Finished update_encuestas_results command")
@@ -1,10 +1,5 @@
 from django.core.management.base import BaseCommand
-from unicef.datamerge.views import (
-    update_csv_completitud_by_comunidad,
-    update_csv_previstas_by_comunidad,
-    update_csv_historico_by_encuesta,
-    update_csv_datetime_last_update
-)
+from unicef.datamerge.views import publish_reports
 from django.test import RequestFactory
 import logging
 
@@ -18,9 +13,6 @@ class Command(BaseCommand):
         factory = RequestFactory()
         request = factory.get('/')
 
-        update_csv_completitud_by_comunidad(request)
-        update_csv_previstas_by_comunidad(request)
-        update_csv_historico_by_encuesta(request)
-        update_csv_datetime_last_update(request)
+        publish_reports(request)
 
-        self.stdout.write(self.style.SUCCESS('Successfully generated and updated CSV files in GitHub'))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS('Successfully generated and updated CSV files in GitHub'))
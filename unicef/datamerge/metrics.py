@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import httpx
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+# Directory holding the report of the last run of each kind, one <run>.json
+# file per kind so concurrent runs of different kinds never overwrite each
+# other. run_reports in the project directory by default
+METRICS_REPORT_DIR = os.getenv("METRICS_REPORT_DIR")
+
+# Upper bounds in seconds of the buckets of the per survey harvest latency
+HARVEST_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Slowest surveys listed in the run report
+METRICS_SLOWEST = int(os.getenv("METRICS_SLOWEST", "10"))
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Type and help of each metric family exposed at /metrics, in output order
+PROMETHEUS_METRICS = {
+    "datamerge_run_timestamp_seconds": ("gauge", "Time the last run finished."),
+    "datamerge_run_duration_seconds": ("gauge", "Duration of the last run."),
+    "datamerge_run_success": ("gauge", "Whether the last run succeeded."),
+    "datamerge_stage_duration_seconds": ("gauge", "Duration of each stage of the last run."),
+    "datamerge_stage_queries": ("gauge", "Database queries of each stage of the last run."),
+    "datamerge_stage_rows": ("gauge", "Rows produced by each stage of the last run."),
+    "datamerge_harvest_surveys": ("gauge", "Surveys fetched from LimeSurvey by the last run."),
+    "datamerge_harvest_retries": ("gauge", "Requests to LimeSurvey retried by the last run."),
+    "datamerge_harvest_errors": ("gauge", "Surveys the last run failed to fetch, by error."),
+    "datamerge_harvest_surveys_within_seconds": ("gauge", "Surveys the last run fetched in at most le seconds."),
+    "datamerge_harvest_latency_sum_seconds": ("gauge", "Time spent fetching all the surveys in the last run."),
+    "datamerge_harvest_slowest_seconds": ("gauge", "Time spent fetching the slowest surveys of the last run."),
+}
+
+
+# Stage running in each thread, for record_rows()
+_current = threading.local()
+
+
+def _error_reason(ex):
+    if isinstance(ex, httpx.HTTPStatusError):
+        return f"HTTP {ex.response.status_code}"
+    return type(ex).__name__
+
+
+class RunMetrics:
+    """Collect the timings and counts of one refresh run.
+
+    Stages are timed with stage(), which also counts the queries run by the
+    current thread meanwhile and the rows given to record_rows(). The harvest
+    reports every survey to observe_harvest(). Can be shared by threads.
+
+    Used as a context manager, the report of the run is written with write()
+    on exit, with status "failed" if an exception was raised.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.started_at = timezone.now()
+        self._start = time.monotonic()
+        self.stages = {}
+        self.latencies = []
+        self.retries = 0
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.write("failed" if exc_type else "ok")
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage of the run.
+
+        Yields:
+            dict: The stage record, with seconds, queries and rows, which the
+                caller can complete.
+        """
+        record = {"seconds": 0.0, "queries": 0, "rows": None}
+
+        def count_query(execute, sql, params, many, context):
+            record["queries"] += 1
+            return execute(sql, params, many, context)
+
+        previous = getattr(_current, "stage", None)
+        _current.stage = record
+        start = time.monotonic()
+        try:
+            with connection.execute_wrapper(count_query):
+                yield record
+        finally:
+            record["seconds"] = round(time.monotonic() - start, 3)
+            _current.stage = previous
+            with self._lock:
+                self.stages[name] = record
+
+    def observe_harvest(self, sid, seconds, retries, error=None):
+        """Record the fetch of a survey.
+
+        Args:
+            sid (str): Survey id.
+            seconds (float): Time spent in requests, without queueing or backoff.
+            retries (int): Attempts after the first one.
+            error (Exception, optional): Error the fetch finally failed with.
+        """
+        with self._lock:
+            self.latencies.append((sid, seconds))
+            self.retries += retries
+            if error is not None:
+                reason = _error_reason(error)
+                self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    def to_dict(self, status="ok"):
+        """Return the run report."""
+        report = {
+            "run": self.run,
+            "status": status,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": timezone.now().isoformat(),
+            "duration_seconds": round(time.monotonic() - self._start, 3),
+            "stages": dict(self.stages),
+        }
+        if self.latencies:
+            seconds = [latency for _, latency in self.latencies]
+            buckets = {
+                str(bound): sum(1 for latency in seconds if latency <= bound)
+                for bound in HARVEST_LATENCY_BUCKETS
+            }
+            buckets["+Inf"] = len(seconds)
+            slowest = sorted(self.latencies, key=lambda item: item[1], reverse=True)
+            report["harvest"] = {
+                "surveys": len(seconds),
+                "retries": self.retries,
+                "errors": dict(self.errors),
+                "latency_seconds": {
+                    "buckets": buckets,
+                    "sum": round(sum(seconds), 3),
+                    "count": len(seconds),
+                },
+                "slowest": [
+                    {"sid": sid, "seconds": round(latency, 3)}
+                    for sid, latency in slowest[:METRICS_SLOWEST]
+                ],
+            }
+        return report
+
+    def write(self, status="ok", directory=None):
+        """Store the report of this run as <run>.json, replacing the previous run of its kind.
+
+        Returns:
+            dict: The run report.
+        """
+        report = self.to_dict(status)
+        directory = _report_dir(directory)
+        path = os.path.join(directory, f"{self.run}.json")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Write a sibling file and rename it so readers never see half a
+            # report; the pid keeps two runs of the same kind apart
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as ex:
+            logging.warning(f"RunMetrics. could not write {path}: {ex}")
+        logging.info(
+            f"RunMetrics. {self.run} {status} in {report['duration_seconds']}s: {json.dumps(report['stages'])}"
+        )
+        return report
+
+
+def record_rows(count):
+    """Add ``count`` rows to the stage running in this thread, if any."""
+    record = getattr(_current, "stage", None)
+    if record is not None:
+        record["rows"] = (record["rows"] or 0) + count
+
+
+def _report_dir(directory=None):
+    return directory or METRICS_REPORT_DIR or os.path.join(settings.BASE_DIR, "run_reports")
+
+
+def load_run_reports(directory=None):
+    """Return the reports of the last run of each kind, by run name, or {} if there is none."""
+    directory = _report_dir(directory)
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return {}
+    reports = {}
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path, encoding="utf-8") as file:
+                report = json.load(file)
+        except (OSError, ValueError) as ex:
+            logging.warning(f"load_run_reports. could not read {path}: {ex}")
+            continue
+        reports[report["run"]] = report
+    return reports
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(reports):
+    """Render run reports, as returned by load_run_reports(), in the Prometheus text format.
+
+    Every value describes the last run of its kind and is replaced by the
+    next one, so all the metrics are gauges, the latency buckets included.
+    """
+    samples = {name: [] for name in PROMETHEUS_METRICS}
+
+    def sample(name, value, **labels):
+        labels = ",".join(f'{label}="{_label_value(v)}"' for label, v in labels.items())
+        samples[name].append(f"{name}{{{labels}}} {value}")
+
+    for run, report in sorted(reports.items()):
+        finished_at = datetime.fromisoformat(report["finished_at"])
+        sample("datamerge_run_timestamp_seconds", round(finished_at.timestamp(), 3), run=run)
+        sample("datamerge_run_duration_seconds", report["duration_seconds"], run=run)
+        sample("datamerge_run_success", int(report["status"] == "ok"), run=run)
+        for stage, record in sorted(report["stages"].items()):
+            sample("datamerge_stage_duration_seconds", record["seconds"], run=run, stage=stage)
+            sample("datamerge_stage_queries", record["queries"], run=run, stage=stage)
+            if record["rows"] is not None:
+                sample("datamerge_stage_rows", record["rows"], run=run, stage=stage)
+
+        harvest = report.get("harvest")
+        if not harvest:
+            continue
+        sample("datamerge_harvest_surveys", harvest["surveys"], run=run)
+        sample("datamerge_harvest_retries", harvest["retries"], run=run)
+        for reason, count in sorted(harvest["errors"].items()):
+            sample("datamerge_harvest_errors", count, run=run, reason=reason)
+        latency = harvest["latency_seconds"]
+        for bound, count in latency["buckets"].items():
+            sample("datamerge_harvest_surveys_within_seconds", count, run=run, le=bound)
+        sample("datamerge_harvest_latency_sum_seconds", latency["sum"], run=run)
+        for slow in harvest["slowest"]:
+            sample("datamerge_harvest_slowest_seconds", slow["seconds"], run=run, sid=slow["sid"])
+
+    lines = []
+    for name, (kind, help_text) in PROMETHEUS_METRICS.items():
+        if samples[name]:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples[name])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def populate_latest_results(apps, schema_editor):
+    EncuestaResult = apps.get_model("datamerge", "EncuestaResult")
+    LatestEncuestaResult = apps.get_model("datamerge", "LatestEncuestaResult")
+
+    latest = {}
+    for result in EncuestaResult.objects.order_by("encuesta_id", "-date").iterator():
+        if result.encuesta_id not in latest:
+            latest[result.encuesta_id] = LatestEncuestaResult(
+                encuesta_id=result.encuesta_id,
+                date=result.date,
+                encuestas_cubiertas=result.encuestas_cubiertas,
+                encuestas_incompletas=result.encuestas_incompletas,
+                encuestas_totales=result.encuestas_totales,
+            )
+    LatestEncuestaResult.objects.bulk_create(latest.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datamerge', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestEncuestaResult',
+            fields=[
+                ('encuesta', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_result', serialize=False, to='datamerge.encuesta')),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('encuestas_cubiertas', models.IntegerField()),
+                ('encuestas_incompletas', models.IntegerField()),
+                ('encuestas_totales', models.IntegerField()),
+            ],
+        ),
+        migrations.RunPython(populate_latest_results, migrations.RunPython.noop),
+    ]
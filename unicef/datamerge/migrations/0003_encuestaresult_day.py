@@ -0,0 +1,47 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:11
+
+from zoneinfo import ZoneInfo
+
+from django.db import migrations, models
+
+
+def collapse_results_by_day(apps, schema_editor):
+    """Fill in the day of every result and keep only the latest result of each day."""
+    EncuestaResult = apps.get_model("datamerge", "EncuestaResult")
+    madrid_tz = ZoneInfo("Europe/Madrid")
+
+    seen = set()
+    to_update = []
+    to_delete = []
+    for result in EncuestaResult.objects.order_by("encuesta_id", "-date").iterator():
+        day = result.date.astimezone(madrid_tz).date()
+        if (result.encuesta_id, day) in seen:
+            to_delete.append(result.pk)
+            continue
+        seen.add((result.encuesta_id, day))
+        result.day = day
+        to_update.append(result)
+
+    for start in range(0, len(to_delete), 500):
+        EncuestaResult.objects.filter(pk__in=to_delete[start : start + 500]).delete()
+    EncuestaResult.objects.bulk_update(to_update, ["day"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datamerge', '0002_latestencuestaresult'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='encuestaresult',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='encuestaresult',
+            name='day',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(collapse_results_by_day, migrations.RunPython.noop),
+    ]
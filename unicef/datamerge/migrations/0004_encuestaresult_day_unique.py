@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:11
+
+import unicef.datamerge.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datamerge', '0003_encuestaresult_day'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='encuestaresult',
+            name='day',
+            field=models.DateField(default=unicef.datamerge.models.current_day),
+        ),
+        migrations.AlterUniqueTogether(
+            name='encuestaresult',
+            unique_together={('encuesta', 'day')},
+        ),
+        migrations.AddIndex(
+            model_name='encuestaresult',
+            index=models.Index(fields=['encuesta', '-day'], name='datamerge_result_enc_day_idx'),
+        ),
+    ]
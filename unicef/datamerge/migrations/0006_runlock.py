@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datamerge', '0005_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunLock',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('holder', models.CharField(blank=True, default='', max_length=64)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_started', models.DateTimeField(blank=True, null=True)),
+                ('last_finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datamerge', '0006_runlock'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='colegio',
+            name='cid',
+            field=models.CharField(db_index=True, max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='encuesta',
+            name='sid',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+    ]
@@ -1,8 +1,16 @@
+from zoneinfo import ZoneInfo
+
 from django.db import models
 from django.utils import timezone
 
+
+def current_day(value=None):
+    # Results are bucketed by day in Madrid time, the timezone the harvest runs in
+    return timezone.localdate(value, timezone=ZoneInfo("Europe/Madrid"))
+
+
 class Colegio(models.Model):
-    cid = models.CharField(max_length=30)  # L1A001 - Primaria
+    cid = models.CharField(max_length=30, db_index=True)  # L1A001 - Primaria
     nombre = models.CharField(max_length=100)
     comunidad_autonoma = models.CharField(max_length=150)
     telefono = models.CharField(max_length=20, null=True, blank=True)
@@ -16,7 +24,7 @@ class Colegio(models.Model):
 
 
 class Encuesta(models.Model):
-    sid = models.CharField(max_length=20)
+    sid = models.CharField(max_length=20, db_index=True)
     titulo = models.CharField(max_length=100)
     fecha_inicio = models.DateTimeField(null=True, blank=True)
     fecha_fin = models.DateTimeField(null=True, blank=True)
@@ -30,12 +38,83 @@ class Encuesta(models.Model):
 class EncuestaResult(models.Model):
     encuesta = models.ForeignKey(Encuesta, on_delete=models.CASCADE, related_name='results')
     date = models.DateTimeField(default=timezone.now)
+    day = models.DateField(default=current_day)
     encuestas_cubiertas = models.IntegerField()
     encuestas_incompletas = models.IntegerField()
     encuestas_totales = models.IntegerField()
 
     class Meta:
-        unique_together = ('encuesta', 'date')
+        unique_together = ('encuesta', 'day')
+        indexes = [
+            models.Index(fields=['encuesta', '-day'], name='datamerge_result_enc_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.encuesta.sid} - {self.date} [c({self.encuestas_cubiertas}) i({self.encuestas_incompletas}) t({self.encuestas_totales})]"
+
+
+class LatestEncuestaResult(models.Model):
+    # Copy of the most recent EncuestaResult of each Encuesta, so reports can join it directly
+    encuesta = models.OneToOneField(Encuesta, on_delete=models.CASCADE, primary_key=True, related_name='latest_result')
+    date = models.DateTimeField(default=timezone.now)
+    encuestas_cubiertas = models.IntegerField()
+    encuestas_incompletas = models.IntegerField()
+    encuestas_totales = models.IntegerField()
 
     def __str__(self):
         return f"{self.encuesta.sid} - {self.date} [c({self.encuestas_cubiertas}) i({self.encuestas_incompletas}) t({self.encuestas_totales})]"
+
+
+class Job(models.Model):
+    # Background task run by the run_jobs worker, see unicef/datamerge/jobs.py
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    payload = models.JSONField(default=dict, blank=True)
+    progress = models.PositiveSmallIntegerField(default=0)  # percent
+    message = models.CharField(max_length=200, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='datamerge_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} [{self.status}]"
+
+
+class RunLock(models.Model):
+    # Serializes the runs of a task across processes, see unicef/datamerge/locks.py
+    name = models.CharField(max_length=50, primary_key=True)
+    holder = models.CharField(max_length=64, blank=True, default='')
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_started = models.DateTimeField(null=True, blank=True)
+    last_finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} [{'locked' if self.holder else 'free'}]"
+
+
+class DataVersion(models.Model):
+    # Counter bumped on every write the reports depend on, see unicef/datamerge/report_cache.py
+    key = models.CharField(max_length=20, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
@@ -0,0 +1,30 @@
+import os
+
+from rest_framework import pagination
+
+# Largest page a client can ask for with ?page_size=
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "1000"))
+
+
+class CursorPagination(pagination.CursorPagination):
+    """Cursor pagination with a client selectable page size.
+
+    Pages are fetched by position instead of OFFSET, so every page costs the
+    same however deep the client goes. Subclasses set the ordering, which
+    must start with an indexed field.
+    """
+
+    page_size_query_param = "page_size"
+    max_page_size = API_MAX_PAGE_SIZE
+
+
+class ColegioCursorPagination(CursorPagination):
+    ordering = ("cid", "pk")
+
+
+class EncuestaCursorPagination(CursorPagination):
+    ordering = ("sid", "pk")
+
+
+class EncuestaResultCursorPagination(CursorPagination):
+    ordering = ("-day",)
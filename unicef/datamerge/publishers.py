@@ -0,0 +1,257 @@
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from django.conf import settings
+from github import Github, GithubException, InputGitTreeElement
+
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+GITHUB_REPO = os.getenv("GITHUB_REPO", "macarracedo/xlsx-sqlite-api")
+
+# Backend used to publish the reports: github, local or memory
+REPORT_PUBLISHER = os.getenv("REPORT_PUBLISHER", "github")
+# Working tree the local backend writes into, the project checkout by default
+REPORT_LOCAL_DIR = os.getenv("REPORT_LOCAL_DIR")
+
+_github_clients = {}
+_github_clients_lock = threading.Lock()
+
+
+def get_github_client(github_token):
+    """Return the authenticated Github client of a token, created once per process."""
+    with _github_clients_lock:
+        if github_token not in _github_clients:
+            _github_clients[github_token] = Github(github_token)
+        return _github_clients[github_token]
+
+
+def git_blob_sha(content):
+    """Return the sha git gives a blob with this content, as found in tree entries."""
+    data = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class BasePublisher(ABC):
+    """Collect report files and publish them together.
+
+    Subclasses implement publish(), which writes every staged file that
+    changed as a single unit and clears the stage. Files can be staged from
+    several threads at once.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def add(self, file_path, content):
+        """Stage the content of a file, replacing any previous content staged for it."""
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        with self._lock:
+            self.files[file_path] = content
+
+    def prepare(self):
+        """Look up what is already published, ahead of publish().
+
+        Called while the reports are still being generated so that the
+        lookup overlaps with them. Does nothing unless the backend is remote.
+        """
+
+    @abstractmethod
+    def publish(self, commit_message="[BOT] Update report CSVs"):
+        """Publish every staged file that changed and clear the stage.
+
+        Returns:
+            str: Identifier of what was published, or None when nothing changed.
+        """
+
+
+class GitHubPublisher(BasePublisher):
+    """Collect report files and push them to a GitHub repository in a single commit.
+
+    Files are staged with add() and written by publish() with the Git Data
+    API: one tree holding every file on top of the branch head, one commit
+    and one ref update, however many files there are. Files whose blob sha
+    matches the one already in the branch are skipped, and no commit is made
+    when nothing changed.
+    """
+
+    def __init__(self, github_token=GITHUB_TOKEN, repo_name=GITHUB_REPO, branch=None):
+        super().__init__()
+        self.github_token = github_token
+        self.repo_name = repo_name
+        self.branch = branch
+        self._prepared = None
+
+    def _branch_state(self):
+        repo = get_github_client(self.github_token).get_repo(self.repo_name)
+        branch = self.branch or repo.default_branch
+        ref = repo.get_git_ref(f"heads/{branch}")
+        head = repo.get_git_commit(ref.object.sha)
+        published = {
+            element.path: element.sha
+            for element in repo.get_git_tree(head.tree.sha, recursive=True).tree
+            if element.type == "blob"
+        }
+        return repo, branch, ref, head, published
+
+    def prepare(self):
+        """Fetch the head of the branch and the blob shas of its tree ahead of publish()."""
+        self._prepared = self._branch_state()
+
+    def publish(self, commit_message="[BOT] Update report CSVs"):
+        """Commit every staged file that changed and clear the stage.
+
+        Returns:
+            str: sha of the new commit, or None when nothing changed.
+        """
+        prepared, self._prepared = self._prepared, None
+        if not self.files:
+            return None
+
+        # Retry once if the branch moved while the commit was being built,
+        # or since prepare() looked it up
+        for attempt in range(2):
+            repo, branch, ref, head, published = (
+                prepared if attempt == 0 and prepared else self._branch_state()
+            )
+            elements = [
+                InputGitTreeElement(file_path, "100644", "blob", content=content)
+                for file_path, content in self.files.items()
+                if published.get(file_path) != git_blob_sha(content)
+            ]
+            if not elements:
+                logging.info(
+                    f"GitHubPublisher. {len(self.files)} files unchanged in {self.repo_name}@{branch}, nothing to commit"
+                )
+                self.files.clear()
+                return None
+            tree = repo.create_git_tree(elements, head.tree)
+            commit = repo.create_git_commit(commit_message, tree, [head])
+            try:
+                ref.edit(commit.sha)
+                break
+            except GithubException as ex:
+                if attempt == 1 or ex.status != 422:
+                    raise
+                logging.warning(f"GitHubPublisher. {branch} moved, retrying commit")
+
+        logging.info(
+            f"GitHubPublisher. committed {len(elements)} of {len(self.files)} files to {self.repo_name}@{branch}: {commit.sha}"
+        )
+        self.files.clear()
+        return commit.sha
+
+
+class LocalGitPublisher(BasePublisher):
+    """Write report files into a local git working tree and commit them with plain git.
+
+    Files whose content on disk is already identical are not rewritten. When
+    ``commit`` is False the files are only written.
+    """
+
+    def __init__(self, repo_dir=None, commit=True):
+        super().__init__()
+        self.repo_dir = Path(repo_dir or REPORT_LOCAL_DIR or settings.BASE_DIR)
+        self.commit = commit
+
+    def _git(self, *args):
+        return subprocess.run(
+            ["git", "-C", str(self.repo_dir), *args],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    def publish(self, commit_message="[BOT] Update report CSVs"):
+        """Write every staged file that changed and commit them.
+
+        Returns:
+            str: sha of the new commit, the written paths joined by commas when
+                not committing, or None when nothing changed.
+        """
+        changed = []
+        for file_path, content in self.files.items():
+            target = self.repo_dir / file_path
+            data = content.encode("utf-8")
+            if target.exists() and target.read_bytes() == data:
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            changed.append(file_path)
+
+        logging.info(
+            f"LocalGitPublisher. wrote {len(changed)} of {len(self.files)} files to {self.repo_dir}"
+        )
+        self.files.clear()
+        if not changed:
+            return None
+        if not self.commit:
+            return ",".join(changed)
+
+        self._git("add", "--", *changed)
+        # Commit only the report files, leaving anything else staged untouched
+        self._git("commit", "-m", commit_message, "--", *changed)
+        return self._git("rev-parse", "HEAD")
+
+
+# Files published by the memory backend, shared by all its publishers so that
+# what a run published can be inspected afterwards; see reset_memory_publisher()
+memory_published = {}
+_memory_lock = threading.Lock()
+
+
+def reset_memory_publisher():
+    """Forget every file published by the memory backend."""
+    with _memory_lock:
+        memory_published.clear()
+
+
+class InMemoryPublisher(BasePublisher):
+    """Keep published report files in memory, for tests and offline runs.
+
+    ``published`` holds the current content of every file, memory_published
+    unless another dict is given, and ``commits`` the (commit_message, files)
+    of each publish() of this publisher that changed something. Staged files
+    belong to each publisher.
+    """
+
+    def __init__(self, published=None):
+        super().__init__()
+        self.published = memory_published if published is None else published
+        self.commits = []
+
+    def publish(self, commit_message="[BOT] Update report CSVs"):
+        with self._lock:
+            files, self.files = self.files, {}
+        with _memory_lock:
+            changed = {
+                file_path: content
+                for file_path, content in files.items()
+                if self.published.get(file_path) != content
+            }
+            self.published.update(changed)
+        if not changed:
+            return None
+        self.commits.append((commit_message, changed))
+        return str(len(self.commits))
+
+
+def get_publisher(backend=None):
+    """Return a publisher of the configured backend.
+
+    Args:
+        backend (str, optional): github, local or memory. Defaults to REPORT_PUBLISHER.
+    """
+    backend = backend or REPORT_PUBLISHER
+    if backend == "github":
+        return GitHubPublisher()
+    if backend == "local":
+        return LocalGitPublisher()
+    if backend == "memory":
+        return InMemoryPublisher()
+    raise ValueError(f"Unknown report publisher: {backend}")
@@ -0,0 +1,117 @@
+import functools
+import hashlib
+import logging
+import os
+
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import DataVersion
+
+# Seconds a report stays cached; entries of older data versions are never read again
+REPORT_CACHE_TIMEOUT = int(os.getenv("REPORT_CACHE_TIMEOUT", str(24 * 3600)))
+
+DATA_VERSION_KEY = "data"
+
+
+def bump_data_version():
+    """Mark the report data as changed, invalidating every cached report.
+
+    Call it in the transaction that writes colegios, encuestas or results.
+    """
+    updated = DataVersion.objects.filter(key=DATA_VERSION_KEY).update(
+        version=F("version") + 1, updated_at=timezone.now()
+    )
+    if not updated:
+        DataVersion.objects.get_or_create(
+            key=DATA_VERSION_KEY, defaults={"version": 1}
+        )
+
+
+def get_data_version():
+    """Return the current (version, updated_at) of the report data."""
+    data_version = DataVersion.objects.filter(key=DATA_VERSION_KEY).first()
+    if data_version is None:
+        return 0, None
+    return data_version.version, data_version.updated_at
+
+
+def cached_report(request, name, build):
+    """Return a report from the cache, or build and cache it, with validators.
+
+    The cache key and the ETag combine the report name, the query string and
+    the data version, so a cached report is served until the data changes.
+    Conditional requests are answered with 304 without building the report.
+
+    Args:
+        request: Request of the report.
+        name (str): Report name.
+        build (callable): Returns the HttpResponse of the report. Streaming
+            responses get the validators but are not cached.
+    """
+    version, updated_at = get_data_version()
+    query = request.GET.urlencode()
+    query_hash = hashlib.md5(query.encode("utf-8")).hexdigest()[:12]
+    etag = f'"{name}-{version}-{query_hash}"'
+    last_modified = int(updated_at.timestamp()) if updated_at else None
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        key = f"report:{name}:{version}:{query_hash}"
+        cached = cache.get(key)
+        if cached is None:
+            response = build()
+            if response.status_code != 200:
+                return response
+            # Streamed reports are never held in memory, so they are not cached
+            if not response.streaming:
+                cache.set(
+                    key,
+                    {
+                        "content": response.content,
+                        "headers": {
+                            header: response[header]
+                            for header in ("Content-Type", "Content-Disposition")
+                            if header in response
+                        },
+                    },
+                    REPORT_CACHE_TIMEOUT,
+                )
+                logging.debug(f"cached_report. {key} built")
+        else:
+            response = HttpResponse(cached["content"])
+            for header, value in cached["headers"].items():
+                response[header] = value
+            logging.debug(f"cached_report. {key} served from cache")
+
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    # Clients may keep the report but must revalidate it on every use
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def cache_report(func):
+    """Serve a report action through cached_report().
+
+    The cache key only covers the query string, so in-process calls that pass
+    any argument, as publish_reports() does with precomputed data, bypass the
+    cache.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, request, *args, **kwargs):
+        if args or any(value is not None for value in kwargs.values()):
+            return func(self, request, *args, **kwargs)
+        return cached_report(
+            request, func.__name__, lambda: func(self, request, *args, **kwargs)
+        )
+
+    return wrapper
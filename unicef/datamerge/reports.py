@@ -0,0 +1,503 @@
+from datetime import timedelta
+from itertools import islice
+
+import pandas as pd
+from django.db.models import F, Window
+from django.db.models.functions import Lag, RowNumber
+
+from .models import Colegio, EncuestaResult, current_day
+
+# Hardcoded values for previstas and centros_previstos
+PREVISTAS = {
+    "ANDALUCÍA": 14271,
+    "ARAGÓN": 3615,
+    "CANARIAS": 4600,
+    "CANTABRIA": 2667,
+    "CASTILLA LEÓN": 4645,
+    "CASTILLA LA MANCHA": 4759,
+    "CATALUÑA": 12373,
+    "MADRID": 11078,
+    "NAVARRA": 2831,
+    "COMUNIDAD VALENCIANA": 8903,
+    "EXTREMADURA": 3280,
+    "GALICIA": 4977,
+    "BALEARES": 3431,
+    "LA RIOJA": 2364,
+    "PAÍS VASCO": 4732,
+    "MELILLA": 2092,
+    "CEUTA": 2090,
+    "ASTURIAS": 3002,
+    "MURCIA": 4290,
+}
+
+CENTROS_PREVISTOS = {
+    "ANDALUCÍA": 72,
+    "ARAGÓN": 18,
+    "CANARIAS": 23,
+    "CANTABRIA": 13,
+    "CASTILLA LEÓN": 23,
+    "CASTILLA LA MANCHA": 24,
+    "CATALUÑA": 63,
+    "MADRID": 56,
+    "NAVARRA": 14,
+    "COMUNIDAD VALENCIANA": 44,
+    "EXTREMADURA": 16,
+    "GALICIA": 25,
+    "BALEARES": 17,
+    "LA RIOJA": 12,
+    "PAÍS VASCO": 24,
+    "MELILLA": 10,
+    "CEUTA": 10,
+    "ASTURIAS": 15,
+    "MURCIA": 21,
+}
+
+# Dictionary for CCAA name mappings
+CCAA_NAME_MAPPINGS = {
+    "MADRID": "COMUNIDAD DE MADRID",
+    "CASTILLA LEÓN": "CASTILLA Y LEÓN",
+    "CASTILLA LA MANCHA": "CASTILLA-LA MANCHA",
+    "PAIS VASCO": "PAÍS VASCO",
+    "NAVARRA": "COMUNIDAD FORAL DE NAVARRA",
+    "ASTURIAS": "PRINCIPADO DE ASTURIAS",
+    "BALEARES": "ISLAS BALEARES",
+    "MURCIA": "REGIÓN DE MURCIA",
+}
+
+# back_days of the historico CSVs published on every run
+HISTORICO_BACK_DAYS = (3, 10, 30)
+
+# Colegios loaded per query when the historico is streamed
+HISTORICO_CHUNK_SIZE = 100
+
+# Encuesta fields of Colegio and the label used for them in the reports
+LEVELS = (
+    ("pri_sid", "Primaria"),
+    ("sec_sid", "Secundaria"),
+    ("pro_sid", "Profesorado"),
+)
+
+# Columns of the historico in long format, one row per encuesta and day
+HISTORICO_LONG_HEADER = [
+    "centro",
+    "tipologia",
+    "encuesta",
+    "day",
+    "delta_completas",
+    "delta_parciales",
+]
+
+
+def load_historico(max_days, encuestas=None, start=None, end=None):
+    """Load the last ``max_days`` results of every encuesta with a single query.
+
+    The daily deltas are computed in the database with LAG() over each
+    encuesta's full history, so the oldest loaded day is still compared with
+    the day before it. When there is no previous result the delta is the
+    value itself.
+
+    Args:
+        max_days (int): Number of most recent results to keep per encuesta.
+        encuestas (list, optional): Ids of the encuestas to load. Defaults to all.
+        start (date, optional): Results of earlier days are dropped after
+            their delta has been computed.
+        end (date, optional): Last day loaded. Defaults to the latest result.
+
+    Returns:
+        dict: encuesta id -> list of result dicts, newest first, with the keys
+            day, encuestas_totales, encuestas_cubiertas, encuestas_incompletas,
+            nuevas_completas and nuevas_parciales.
+    """
+    by_encuesta = [F("encuesta")]
+    results = EncuestaResult.objects.all()
+    if encuestas is not None:
+        results = results.filter(encuesta__in=encuestas)
+    if end is not None:
+        results = results.filter(day__lte=end)
+    results = (
+        results.annotate(
+            row_number=Window(
+                RowNumber(), partition_by=by_encuesta, order_by=F("day").desc()
+            ),
+            prev_cubiertas=Window(
+                Lag("encuestas_cubiertas"),
+                partition_by=by_encuesta,
+                order_by=F("day").asc(),
+            ),
+            prev_incompletas=Window(
+                Lag("encuestas_incompletas"),
+                partition_by=by_encuesta,
+                order_by=F("day").asc(),
+            ),
+        )
+        .filter(row_number__lte=max_days)
+        .order_by("encuesta", "-day")
+        .values(
+            "encuesta",
+            "day",
+            "encuestas_totales",
+            "encuestas_cubiertas",
+            "encuestas_incompletas",
+            "prev_cubiertas",
+            "prev_incompletas",
+        )
+    )
+
+    history = {}
+    for result in results:
+        prev_cubiertas = result.pop("prev_cubiertas")
+        prev_incompletas = result.pop("prev_incompletas")
+        result["nuevas_completas"] = result["encuestas_cubiertas"] - (
+            prev_cubiertas or 0
+        )
+        result["nuevas_parciales"] = result["encuestas_incompletas"] - (
+            prev_incompletas or 0
+        )
+        if start is not None and result["day"] < start:
+            continue
+        history.setdefault(result.pop("encuesta"), []).append(result)
+    return history
+
+
+def historico_days(start, end):
+    """Return the days from ``end`` back to ``start``, both included, newest first."""
+    return [end - timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def historico_header(back_days, days=None):
+    """Return the header of the wide historico.
+
+    The daily columns are named after their distance to today, or after
+    their date when ``days`` is given.
+    """
+    if days is not None:
+        header = historico_header(0)
+        for day in days:
+            header.append(f"Nuevas Completas {day.isoformat()}")
+            header.append(f"Nuevas Parciales {day.isoformat()}")
+        return header
+
+    header = [
+        "Centro",
+        "Tipologia",
+        "Id encuesta",
+        "Total Encuestas",
+        "Total Completas",
+        "Total Parciales",
+    ]
+    for i in range(back_days):
+        if i == 0:
+            header.append("Nuevas Completas Hoy")
+            header.append("Nuevas Parciales Hoy")
+        else:
+            header.append(f"Nuevas Completas D-{i}")
+            header.append(f"Nuevas Parciales D-{i}")
+    return header
+
+
+def _encuesta_histories(colegios, history, levels):
+    for colegio in colegios:
+        for field, tipologia in levels:
+            encuesta = getattr(colegio, field)
+            results = history.get(encuesta.pk) if encuesta else None
+            if results:
+                yield colegio, tipologia, encuesta, results
+
+
+def historico_rows(colegios, history, back_days, days=None, levels=LEVELS):
+    """Yield one historico row per encuesta of each colegio with results.
+
+    Results are matched to the daily columns by date, so a day without a
+    result leaves its pair empty instead of shifting the older days.
+
+    Args:
+        colegios (iterable): Colegio objects with their encuestas selected.
+        history (dict): As returned by load_historico() with at least back_days per encuesta.
+        back_days (int): Number of daily delta column pairs, ending today.
+        days (list, optional): Dates of the daily columns, newest first, as
+            returned by historico_days(). back_days is then ignored.
+        levels (tuple, optional): Subset of LEVELS to include.
+    """
+    if days is None:
+        today = current_day()
+        days = historico_days(today - timedelta(days=back_days - 1), today)
+    for colegio, tipologia, encuesta, results in _encuesta_histories(
+        colegios, history, levels
+    ):
+        row = [
+            colegio.nombre,
+            tipologia,
+            encuesta.sid,
+            results[0]["encuestas_totales"],
+            results[0]["encuestas_cubiertas"],
+            results[0]["encuestas_incompletas"],
+        ]
+        by_day = {result["day"]: result for result in results}
+        for day in days:
+            result = by_day.get(day)
+            if result is not None:
+                row.append(result["nuevas_completas"])
+                row.append(result["nuevas_parciales"])
+            else:
+                row.append("")
+                row.append("")
+        yield row
+
+
+def historico_long_rows(colegios, history, levels=LEVELS):
+    """Yield the historico in long format, one row per encuesta and day, oldest day first.
+
+    The columns are those of HISTORICO_LONG_HEADER.
+    """
+    for colegio, tipologia, encuesta, results in _encuesta_histories(
+        colegios, history, levels
+    ):
+        for result in reversed(results):
+            yield [
+                colegio.nombre,
+                tipologia,
+                encuesta.sid,
+                result["day"],
+                result["nuevas_completas"],
+                result["nuevas_parciales"],
+            ]
+
+
+def iter_historico(
+    max_days, levels=LEVELS, start=None, end=None, chunk_size=HISTORICO_CHUNK_SIZE
+):
+    """Yield (colegios, history) for every colegio holding one chunk in memory at a time.
+
+    Colegios are read with a server-side cursor where the database has one,
+    and the history of each chunk of ``chunk_size`` colegios is loaded with
+    its own windowed query, as load_historico() does, so memory does not
+    grow with the number of colegios.
+    """
+    colegios = (
+        Colegio.objects.select_related("pri_sid", "sec_sid", "pro_sid")
+        .order_by("pk")
+        .iterator(chunk_size=chunk_size)
+    )
+    while chunk := list(islice(colegios, chunk_size)):
+        encuestas = [
+            encuesta.pk
+            for colegio in chunk
+            for field, _ in levels
+            if (encuesta := getattr(colegio, field))
+        ]
+        yield chunk, load_historico(max_days, encuestas=encuestas, start=start, end=end)
+
+
+def load_report_frame():
+    """Load the latest results of every colegio and level with a single query.
+
+    Returns:
+        pandas.DataFrame: One row per colegio and level with the columns
+            colegio, comunidad_autonoma, nivel, totales, cubiertas and
+            incompletas. Levels without encuesta or results count as 0.
+    """
+    counts = ("totales", "cubiertas", "incompletas")
+    columns = ["colegio", "comunidad_autonoma"]
+    lookups = ["id", "comunidad_autonoma"]
+    for field, _ in LEVELS:
+        for count in counts:
+            columns.append(f"{field}_{count}")
+            lookups.append(f"{field}__latest_result__encuestas_{count}")
+    wide = pd.DataFrame.from_records(
+        Colegio.objects.values_list(*lookups), columns=columns
+    )
+
+    levels = []
+    for field, nivel in LEVELS:
+        level = wide[["colegio", "comunidad_autonoma"]].assign(nivel=nivel)
+        for count in counts:
+            level[count] = (
+                pd.to_numeric(wide[f"{field}_{count}"], errors="coerce")
+                .fillna(0)
+                .astype("int64")
+            )
+        levels.append(level)
+    return pd.concat(levels, ignore_index=True)
+
+
+def _sum_by_comunidad(frame, niveles=None):
+    if niveles is not None:
+        frame = frame[frame["nivel"].isin(niveles)]
+    return frame.groupby("comunidad_autonoma", sort=True).agg(
+        totales=("totales", "sum"),
+        cubiertas=("cubiertas", "sum"),
+        incompletas=("incompletas", "sum"),
+        centros=("colegio", "nunique"),
+    )
+
+
+def _porcentaje(part, total):
+    return (part / total) * 100 if total > 0 else 0
+
+
+def completitud_by_comunidad(frame):
+    """Return the header and rows, totals last, of the completitud report."""
+    grouped = _sum_by_comunidad(frame)
+    grouped["porcentaje"] = (
+        grouped["cubiertas"] * 100.0 / grouped["totales"]
+    ).where(grouped["totales"] != 0, 0.0)
+
+    header = [
+        "comunidad",
+        "encuestas_totales",
+        "encuestas_cubiertas",
+        "encuestas_incompletas",
+        "porcentaje",
+        "total_centros",
+    ]
+    rows = [
+        [
+            comunidad,
+            int(totales),
+            int(cubiertas),
+            int(incompletas),
+            float(porcentaje),
+            int(centros),
+        ]
+        for comunidad, totales, cubiertas, incompletas, centros, porcentaje in (
+            grouped.itertuples()
+        )
+    ]
+    total_totales = sum(row[1] for row in rows)
+    total_cubiertas = sum(row[2] for row in rows)
+    rows.append(
+        [
+            "Totales",
+            total_totales,
+            total_cubiertas,
+            sum(row[3] for row in rows),
+            (
+                (total_cubiertas * 100.0 / total_totales)
+                if total_totales > 0
+                else 0
+            ),
+            sum(row[5] for row in rows),
+        ]
+    )
+    return header, rows
+
+
+def _previstas_by_comunidad(frame, niveles, realizadas_label):
+    grouped = _sum_by_comunidad(frame, niveles)
+
+    header = [
+        "CCAA",
+        "Previstas",
+        realizadas_label,
+        "Faltan",
+        "Porcentaje",
+        "Centros previstos",
+        "Centros actuales",
+        "Porcentaje1",
+    ]
+    rows = []
+    totals = [0, 0, 0, 0, 0]
+    for comunidad, realizadas, centros_actuales in grouped[
+        ["totales", "centros"]
+    ].itertuples():
+        previstas = PREVISTAS.get(comunidad, 0)
+        realizadas = int(realizadas)
+        centros_actuales = int(centros_actuales)
+        centros_previstos = CENTROS_PREVISTOS.get(comunidad, 0)
+        faltan = previstas - realizadas
+        rows.append(
+            [
+                comunidad,
+                previstas,
+                realizadas,
+                faltan,
+                f"{_porcentaje(realizadas, previstas):.2f}%",
+                centros_previstos,
+                centros_actuales,
+                f"{_porcentaje(centros_actuales, centros_previstos):.2f}%",
+            ]
+        )
+        for i, value in enumerate(
+            (previstas, realizadas, faltan, centros_previstos, centros_actuales)
+        ):
+            totals[i] += value
+
+    total_previstas, total_realizadas, total_faltan, total_cp, total_ca = totals
+    rows.append(
+        [
+            "Totales",
+            total_previstas,
+            total_realizadas,
+            total_faltan,
+            f"{_porcentaje(total_realizadas, total_previstas):.2f}%",
+            total_cp,
+            total_ca,
+            f"{_porcentaje(total_ca, total_cp):.2f}%",
+        ]
+    )
+    return header, rows
+
+
+def previstas_by_comunidad(frame):
+    """Return the header and rows, totals last, of the previstas report."""
+    return _previstas_by_comunidad(frame, None, "Realizadas")
+
+
+def previstas_alumnado_by_comunidad(frame):
+    """Return the header and rows, totals last, of the previstas alumnado report."""
+    return _previstas_by_comunidad(
+        frame, ["Primaria", "Secundaria"], "Realizadas Alumnado"
+    )
+
+
+def tipologia_by_comunidad(frame):
+    """Return the header and rows, totals last, of the tipologia report."""
+    niveles = [nivel for _, nivel in LEVELS]
+    grouped = frame.pivot_table(
+        index="comunidad_autonoma",
+        columns="nivel",
+        values="totales",
+        aggfunc="sum",
+        fill_value=0,
+    ).reindex(columns=niveles, fill_value=0)
+
+    header = [
+        "CCAA",
+        "Realizadas Primaria",
+        "Realizadas Secundaria",
+        "Realizadas Profesorado",
+        "Realizadas Total",
+    ]
+    rows = []
+    for comunidad, *realizadas in grouped.itertuples():
+        realizadas = [int(value) for value in realizadas]
+        rows.append([comunidad, *realizadas, sum(realizadas)])
+    rows.append(
+        ["Totales"] + [sum(row[i] for row in rows) for i in range(1, len(header))]
+    )
+    return header, rows
+
+
+def order_by_comunidad(header, rows):
+    """Rename the CCAA of each row and sort the rows for publishing.
+
+    The names in the first column are replaced using CCAA_NAME_MAPPINGS, the
+    rows are sorted alphabetically by the CCAA or comunidad column and the
+    last row after sorting, the totals, is moved to the top.
+    """
+    rows = [
+        [CCAA_NAME_MAPPINGS.get(row[0], row[0]), *row[1:]] for row in rows
+    ]
+
+    # Identify the column index for CCAA or comunidad
+    for column in ("CCAA", "comunidad", "comunidad_autonoma"):
+        if column in header:
+            sort_index = header.index(column)
+            break
+    else:
+        return rows
+
+    rows.sort(key=lambda row: row[sort_index])
+    if rows:
+        rows.insert(0, rows.pop())
+    return rows
@@ -1,5 +1,5 @@
 from django.contrib.auth.models import Group, User
-from unicef.datamerge.models import Encuesta, Colegio, EncuestaResult
+from unicef.datamerge.models import Encuesta, Colegio, EncuestaResult, Job
 from rest_framework import serializers
 
 
@@ -15,10 +15,32 @@ class GroupSerializer(serializers.HyperlinkedModelSerializer):
         fields = ["url", "name"]
 
 
+class SparseFieldsetMixin:
+    """Render only the fields listed in the comma separated ?fields= query parameter of GET requests."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get("request"))
+        if fields:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+def requested_fields(request):
+    """Return the set of field names of the ?fields= query parameter, or None if there is none."""
+    if request is None or request.method != "GET":
+        return None
+    fields = request.query_params.get("fields")
+    if not fields:
+        return None
+    return {name.strip() for name in fields.split(",") if name.strip()}
+
+
 class EncuestaResultSerializer(serializers.ModelSerializer):
     class Meta:
         model = EncuestaResult
         fields = [
+            "day",
             "date",
             "encuestas_cubiertas",
             "encuestas_incompletas",
@@ -26,7 +48,7 @@ class EncuestaResultSerializer(serializers.ModelSerializer):
         ]
 
 
-class EncuestaSerializer(serializers.HyperlinkedModelSerializer):
+class EncuestaSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     results = EncuestaResultSerializer(many=True, read_only=True)
 
     class Meta:
@@ -42,7 +64,7 @@ class EncuestaSerializer(serializers.HyperlinkedModelSerializer):
         ]
 
 
-class ColegioSerializer(serializers.HyperlinkedModelSerializer):
+class ColegioSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Colegio
         fields = [
@@ -55,5 +77,25 @@ class ColegioSerializer(serializers.HyperlinkedModelSerializer):
             "sec_sid",
             "pro_sid",
         ]
+
+
+class JobSerializer(serializers.HyperlinkedModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            "url",
+            "id",
+            "kind",
+            "status",
+            "progress",
+            "message",
+            "result",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+
+
 class FileUploadSerializer(serializers.Serializer):
     cocina_csv = serializers.FileField()
\ No newline at end of file
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Colegio, Encuesta, EncuestaResult
+from .report_cache import bump_data_version
+from .utils import refresh_latest_encuesta_results
+
+
+# Single object writes (admin, API, update_or_create) do not go through the
+# bulk helpers, which bump the data version themselves. LatestEncuestaResult
+# has no receiver, so its deletes stay fast.
+@receiver(post_save, sender=Colegio)
+@receiver(post_save, sender=Encuesta)
+@receiver(post_delete, sender=Colegio)
+@receiver(post_delete, sender=Encuesta)
+def bump_data_version_on_write(sender, **kwargs):
+    bump_data_version()
+
+
+# Result deletes have no receiver either: deleting an Encuesta then removes
+# its whole history with one query and bumps the version once. The admin
+# refreshes the snapshot when it deletes results directly.
+@receiver(post_save, sender=EncuestaResult)
+def refresh_latest_result_on_save(sender, instance, **kwargs):
+    # Keep the snapshot the reports read in step, which also bumps the version
+    refresh_latest_encuesta_results([instance.encuesta_id])
@@ -1,93 +1,97 @@
-import pandas as pd
-import requests
 import logging
+from zoneinfo import ZoneInfo
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from django.utils import timezone
-from django.http import HttpRequest
 from .models import (
     Encuesta,
     EncuestaResult,
+    LatestEncuestaResult,
+    current_day,
 )  # Adjust the import path according to your project structure
-from dotenv import load_dotenv
-import os
-from github import Github
-
-API_LIMESURVEY = os.getenv("API_LIMESURVEY")
-INTERNAL_LS_USER = os.getenv("INTERNAL_LS_USER")
-INTERNAL_LS_PASS = os.getenv("INTERNAL_LS_PASS")
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+from .report_cache import bump_data_version
 
 logging.basicConfig(level=logging.DEBUG)
-# Cargar las variables de entorno desde el archivo .env
-load_dotenv()
-
-
-def update_encuesta_by_sid(sid, check_results=True):
-    logging.debug(f"update_encuesta_by_sid. sid: {sid}")
-    if not sid:
-        raise ValueError("SID is required")
-
-    payload = {"sid": sid, "usr": INTERNAL_LS_USER, "pass": INTERNAL_LS_PASS}
-
-    try:
-        # Se realiza la petición POST al servicio externo
-        response = requests.post(API_LIMESURVEY, data=payload, verify=False)
-        response.raise_for_status()  # Lanza excepción en caso de error HTTP
-        data_externa = response.json()  # Se decodifica la respuesta JSON
-
-        # Create or update the Encuesta object
-        encuesta, created = Encuesta.objects.update_or_create(
-            sid=sid,
-            defaults={
-                "titulo": data_externa["Encuesta"]["Titulo encuesta"],
-                "fecha_inicio": data_externa["Encuesta"]["Fecha de inicio"],
-                "fecha_fin": data_externa["Encuesta"]["Fecha de fin"],
-                "activa": data_externa["Encuesta"]["Activa"],
-                "url": data_externa["Encuesta"]["Url"],
-            },
-        )
-        if check_results:
-            # Update or create the daily result
-            now = timezone.now()
-            EncuestaResult.objects.update_or_create(
-                encuesta=encuesta,
-                date=now,
-                defaults={
-                    "encuestas_cubiertas": data_externa["Encuesta"][
-                        "Encuestas cubiertas"
-                    ],
-                    "encuestas_incompletas": data_externa["Encuesta"][
-                        "Encuestas incompletas"
-                    ],
-                    "encuestas_totales": data_externa["Encuesta"]["Encuestas totales"],
-                },
-            )
-        logging.debug(
-            f"update_encuesta_by_sid. encuesta with sid {encuesta.sid} updated"
+
+
+def encuesta_defaults(data_externa):
+    """Return the Encuesta fields from a LimeSurvey response."""
+    return {
+        "titulo": data_externa["Encuesta"]["Titulo encuesta"],
+        "fecha_inicio": data_externa["Encuesta"]["Fecha de inicio"],
+        "fecha_fin": data_externa["Encuesta"]["Fecha de fin"],
+        "activa": data_externa["Encuesta"]["Activa"],
+        "url": data_externa["Encuesta"]["Url"],
+    }
+
+
+def bulk_upsert_encuestas(encuestas_data):
+    """Create or update many Encuesta objects with bulk queries in one transaction.
+
+    Existing encuestas are loaded with a single query keyed by sid; when a sid
+    is stored more than once the oldest row is updated.
+
+    Args:
+        encuestas_data (dict): sid -> fields, as returned by encuesta_defaults().
+
+    Returns:
+        dict: sid -> Encuesta.
+    """
+    with transaction.atomic():
+        encuestas = {}
+        for encuesta in Encuesta.objects.filter(sid__in=encuestas_data).order_by("pk"):
+            encuestas.setdefault(encuesta.sid, encuesta)
+
+        to_create = []
+        to_update = []
+        for sid, fields in encuestas_data.items():
+            encuesta = encuestas.get(sid)
+            if encuesta is None:
+                encuesta = encuestas[sid] = Encuesta(sid=sid)
+                to_create.append(encuesta)
+            else:
+                to_update.append(encuesta)
+            for field, value in fields.items():
+                setattr(encuesta, field, value)
+
+        Encuesta.objects.bulk_create(to_create, batch_size=500)
+        Encuesta.objects.bulk_update(
+            to_update,
+            ["titulo", "fecha_inicio", "fecha_fin", "activa", "url"],
+            batch_size=500,
         )
-        return encuesta
-
-    except requests.RequestException as ex:
-        raise Exception(f"Error en la petición al servicio externo, {str(ex)}")
-    except ValueError as ex:
-        raise Exception(f"Respuesta JSON inválida, {str(ex)}")
-    except Encuesta.DoesNotExist:
-        raise Exception(f"Encuesta not found with SID: {sid}")
-
-
-def update_or_create_encuesta_result(encuesta, data_externa):
-    # Set timezone to Madrid
-    timezone.activate("Europe/Madrid")
-    madrid_tz = timezone.get_current_timezone()
-    now = timezone.localtime(timezone.now(), madrid_tz)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-    # Check if there is already an EncuestaResult for today
-    encuesta_result, created = EncuestaResult.objects.update_or_create(
-        encuesta=encuesta,
-        date__range=(today_start, today_end),
-        defaults={
-            "date": now,
+        bump_data_version()
+
+    logging.info(
+        f"bulk_upsert_encuestas. {len(to_create)} encuestas created, {len(to_update)} updated"
+    )
+    return encuestas
+
+
+def bulk_upsert_encuesta_results(encuesta_results):
+    """Write the daily results of many encuestas in a single transaction.
+
+    Today's EncuestaResult rows are upserted on (encuesta, day) and the
+    LatestEncuestaResult rows on encuesta, each with one bulk statement. The
+    activa, fecha_inicio and fecha_fin of the encuestas are refreshed from
+    the same responses, so the incremental harvest sees surveys reopened or
+    extended in LimeSurvey.
+
+    Args:
+        encuesta_results (list): (encuesta, data_externa) pairs as returned by LimeSurvey.
+
+    Returns:
+        int: Number of results written.
+    """
+    now = timezone.localtime(timezone.now(), ZoneInfo("Europe/Madrid"))
+    today = current_day(now)
+
+    results = []
+    latest_results = []
+    encuestas = []
+    for encuesta, data_externa in encuesta_results:
+        counts = {
             "encuestas_cubiertas": data_externa.get("Encuesta", {}).get(
                 "Encuestas cubiertas"
             ),
@@ -97,42 +101,81 @@ def update_or_create_encuesta_result(encuesta, data_externa):
             "encuestas_totales": data_externa.get("Encuesta", {}).get(
                 "Encuestas totales"
             ),
-        },
-    )
+        }
+        if None in counts.values():
+            logging.error(f"Missing result counts for {encuesta.sid}: {data_externa}")
+            continue
+        results.append(EncuestaResult(encuesta=encuesta, date=now, day=today, **counts))
+        status = data_externa["Encuesta"]
+        if {"Activa", "Fecha de inicio", "Fecha de fin"} <= status.keys():
+            encuesta.activa = status["Activa"]
+            encuesta.fecha_inicio = status["Fecha de inicio"]
+            encuesta.fecha_fin = status["Fecha de fin"]
+            encuestas.append(encuesta)
+        latest_results.append(
+            LatestEncuestaResult(encuesta=encuesta, date=now, **counts)
+        )
 
-    if created:
-        logging.info(f"Created new EncuestaResult for {encuesta.sid} on {now.date()}")
-    else:
-        logging.info(
-            f"Updated existing EncuestaResult for {encuesta.sid} on {now.date()}"
+    result_fields = [
+        "date",
+        "encuestas_cubiertas",
+        "encuestas_incompletas",
+        "encuestas_totales",
+    ]
+    with transaction.atomic():
+        EncuestaResult.objects.bulk_create(
+            results,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["encuesta", "day"],
+            update_fields=result_fields,
+        )
+        LatestEncuestaResult.objects.bulk_create(
+            latest_results,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["encuesta"],
+            update_fields=result_fields,
+        )
+        Encuesta.objects.bulk_update(
+            encuestas, ["activa", "fecha_inicio", "fecha_fin"], batch_size=500
         )
+        bump_data_version()
 
-    return encuesta_result
+    logging.info(
+        f"bulk_upsert_encuesta_results. upserted {len(results)} results for {today}"
+    )
+    return len(results)
 
 
-def push_to_gh_repo(
-    github_token,
-    csv_data,
-    file_path="data/test/colegios_data.csv",
-    commit_message="[BOT] Update colegios data CSV",
-):
-    """This method pushes csv data to a GitHub repository.
+def refresh_latest_encuesta_results(encuestas=None):
+    """Rebuild the LatestEncuestaResult table from the full EncuestaResult history.
 
     Args:
-        csv_data (str): The CSV data to be pushed.
+        encuestas (list, optional): Ids of the encuestas to rebuild. Defaults to all.
     """
-    # GitHub repository and file details
-    repo_name = "macarracedo/xlsx-sqlite-api"
-    g = Github(github_token)
-    repo = g.get_repo(repo_name)
-
-    print(f"github token: {github_token}")
-    print(f"repo: {repo}")
-
-    try:
-        # Get the file if it exists
-        contents = repo.get_contents(file_path)
-        repo.update_file(contents.path, commit_message, csv_data, contents.sha)
-    except Exception as e:
-        # If the file does not exist, create it
-        repo.create_file(file_path, commit_message, csv_data)
+    newest_date = (
+        EncuestaResult.objects.filter(encuesta=OuterRef("encuesta"))
+        .order_by("-date")
+        .values("date")[:1]
+    )
+    results = EncuestaResult.objects.filter(date=Subquery(newest_date))
+    snapshots = LatestEncuestaResult.objects.all()
+    if encuestas is not None:
+        results = results.filter(encuesta__in=encuestas)
+        snapshots = snapshots.filter(encuesta__in=encuestas)
+    latest_results = [
+        LatestEncuestaResult(
+            encuesta_id=result.encuesta_id,
+            date=result.date,
+            encuestas_cubiertas=result.encuestas_cubiertas,
+            encuestas_incompletas=result.encuestas_incompletas,
+            encuestas_totales=result.encuestas_totales,
+        )
+        for result in results
+    ]
+    with transaction.atomic():
+        snapshots.delete()
+        LatestEncuestaResult.objects.bulk_create(latest_results, batch_size=500)
+        bump_data_version()
+    logging.info(f"Rebuilt {len(latest_results)} LatestEncuestaResult rows")
@@ -1,116 +1,92 @@
 import requests
-import concurrent.futures
+import httpx
 from django.contrib.auth.models import Group, User
-from rest_framework import permissions, viewsets, status, views
+from rest_framework import permissions, viewsets, status
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET
 from rest_framework.decorators import action
-from django.http import JsonResponse, HttpResponse
+from rest_framework.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Prefetch
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.test import RequestFactory
 from unicef.datamerge.serializers import (
     GroupSerializer,
     UserSerializer,
     EncuestaSerializer,
-    EncuestaResult,
+    EncuestaResultSerializer,
     ColegioSerializer,
     FileUploadSerializer,
+    JobSerializer,
+    requested_fields,
 )
-from unicef.datamerge.management.commands import update_encuestas_results
-from unicef.datamerge.utils import (
-    update_encuesta_by_sid,
-    update_or_create_encuesta_result,
-    push_to_gh_repo,
+from unicef.datamerge.pagination import (
+    ColegioCursorPagination,
+    EncuestaCursorPagination,
+    EncuestaResultCursorPagination,
 )
+from unicef.datamerge.harvester import harvest_encuestas, select_encuestas_to_poll
+from unicef.datamerge.reports import (
+    HISTORICO_BACK_DAYS,
+    HISTORICO_LONG_HEADER,
+    LEVELS,
+    load_historico,
+    historico_days,
+    historico_header,
+    historico_rows,
+    historico_long_rows,
+    iter_historico,
+    load_report_frame,
+    completitud_by_comunidad,
+    previstas_by_comunidad,
+    previstas_alumnado_by_comunidad,
+    tipologia_by_comunidad,
+    order_by_comunidad,
+)
+from unicef.datamerge.importers import (
+    parse_cocina_old,
+    parse_cocina_new,
+    exclude_existing_colegios,
+    fetch_encuestas,
+    import_colegios,
+)
+from unicef.datamerge.jobs import enqueue
+from unicef.datamerge.locks import run_exclusive
+from unicef.datamerge.metrics import (
+    PROMETHEUS_CONTENT_TYPE,
+    RunMetrics,
+    load_run_reports,
+    record_rows,
+    render_prometheus,
+)
+from unicef.datamerge.publishers import get_publisher
+from unicef.datamerge.report_cache import cache_report
+from unicef.datamerge.utils import bulk_upsert_encuesta_results
 from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from unicef.datamerge.models import Encuesta, Colegio, EncuestaResult
-from django.db.models import (
-    Sum,
-    Count,
-    F,
-    FloatField,
-    ExpressionWrapper,
-    Value,
-    OuterRef,
-    Subquery,
-    IntegerField,
-    Case,
-    When,
-)
-from django.db.models.functions import Coalesce
+from unicef.datamerge.models import Encuesta, Colegio, EncuestaResult, Job, current_day
 import logging
 import csv
-import re
 import io
 import os
-from io import StringIO
-from github import Github
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import pytz
 
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+# Days of results embedded in each encuesta of the API by default, 0 for all
+ENCUESTA_RESULTS_DAYS = int(os.getenv("ENCUESTA_RESULTS_DAYS", "30"))
+# Longest window, in days, the historico report can be asked for
+HISTORICO_MAX_DAYS = int(os.getenv("HISTORICO_MAX_DAYS", "366"))
+# Threads generating the published reports, 1 to generate them one after another
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "4"))
 API_LIMESURVEY = os.getenv("API_LIMESURVEY")
 INTERNAL_LS_USER = os.getenv("INTERNAL_LS_USER")
 INTERNAL_LS_PASS = os.getenv("INTERNAL_LS_PASS")
 
-# Hardcoded values for previstas and centros_previstos
-PREVISTAS = {
-    "ANDALUCÍA": 14271,
-    "ARAGÓN": 3615,
-    "CANARIAS": 4600,
-    "CANTABRIA": 2667,
-    "CASTILLA LEÓN": 4645,
-    "CASTILLA LA MANCHA": 4759,
-    "CATALUÑA": 12373,
-    "MADRID": 11078,
-    "NAVARRA": 2831,
-    "COMUNIDAD VALENCIANA": 8903,
-    "EXTREMADURA": 3280,
-    "GALICIA": 4977,
-    "BALEARES": 3431,
-    "LA RIOJA": 2364,
-    "PAÍS VASCO": 4732,
-    "MELILLA": 2092,
-    "CEUTA": 2090,
-    "ASTURIAS": 3002,
-    "MURCIA": 4290,
-}
-
-CENTROS_PREVISTOS = {
-    "ANDALUCÍA": 72,
-    "ARAGÓN": 18,
-    "CANARIAS": 23,
-    "CANTABRIA": 13,
-    "CASTILLA LEÓN": 23,
-    "CASTILLA LA MANCHA": 24,
-    "CATALUÑA": 63,
-    "MADRID": 56,
-    "NAVARRA": 14,
-    "COMUNIDAD VALENCIANA": 44,
-    "EXTREMADURA": 16,
-    "GALICIA": 25,
-    "BALEARES": 17,
-    "LA RIOJA": 12,
-    "PAÍS VASCO": 24,
-    "MELILLA": 10,
-    "CEUTA": 10,
-    "ASTURIAS": 15,
-    "MURCIA": 21,
-}
-
-# Dictionary for CCAA name mappings
-CCAA_NAME_MAPPINGS = {
-    "MADRID": "COMUNIDAD DE MADRID",
-    "CASTILLA LEÓN": "CASTILLA Y LEÓN",
-    "CASTILLA LA MANCHA": "CASTILLA-LA MANCHA",
-    "PAIS VASCO": "PAÍS VASCO",
-    "NAVARRA": "COMUNIDAD FORAL DE NAVARRA",
-    "ASTURIAS": "PRINCIPADO DE ASTURIAS",
-    "BALEARES": "ISLAS BALEARES",
-    "MURCIA": "REGIÓN DE MURCIA",
-}
-
 logging.basicConfig(level=logging.INFO)
 # Cargar las variables de entorno desde el archivo .env
 load_dotenv()
@@ -144,6 +120,147 @@ class EncuestaViewSet(viewsets.ModelViewSet):
     queryset = Encuesta.objects.all().order_by("sid")
     serializer_class = EncuestaSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = EncuestaCursorPagination
+
+    def get_queryset(self):
+        """Prefetch the embedded results, limited to the last ENCUESTA_RESULTS_DAYS days by default.
+
+        The history embedded in each encuesta can be narrowed with the query
+        parameters results_days, results_from and results_to; results_days=0
+        embeds the full history.
+        """
+        queryset = super().get_queryset()
+        fields = requested_fields(self.request)
+        if self.action in ("list", "retrieve") and (fields is None or "results" in fields):
+            results = filter_results(
+                EncuestaResult.objects.order_by("day"),
+                self.request,
+                default_days=ENCUESTA_RESULTS_DAYS,
+            )
+            queryset = queryset.prefetch_related(Prefetch("results", queryset=results))
+        return queryset
+
+    @action(detail=True, methods=["get"])
+    def results(self, request, *args, **kwargs):
+        """Daily results of an encuesta, newest first, with cursor pagination.
+
+        Accepts the same results_days, results_from and results_to query
+        parameters as the encuestas, without a default limit.
+        """
+        encuesta = self.get_object()
+        results = filter_results(
+            EncuestaResult.objects.filter(encuesta=encuesta).order_by("-day"), request
+        )
+        paginator = EncuestaResultCursorPagination()
+        page = paginator.paginate_queryset(results, request, view=self)
+        serializer = EncuestaResultSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+def _date_param(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError({name: "Expected a date as YYYY-MM-DD"})
+
+
+def filter_results(results, request, default_days=None):
+    """Filter an EncuestaResult queryset by the results_* query parameters.
+
+    Args:
+        results (QuerySet): EncuestaResult queryset.
+        request: Request with the optional query parameters results_days, the
+            number of most recent days to keep (0 for all), and results_from
+            and results_to, inclusive dates.
+        default_days (int, optional): Days kept when no parameter is given.
+    """
+    days = request.query_params.get("results_days")
+    start = _date_param(request, "results_from")
+    end = _date_param(request, "results_to")
+    if days is not None:
+        try:
+            days = int(days)
+        except ValueError:
+            raise ValidationError({"results_days": "Expected a number of days"})
+    elif start is None and end is None:
+        days = default_days
+
+    if days:
+        results = results.filter(day__gt=current_day() - timedelta(days=days))
+    if start is not None:
+        results = results.filter(day__gte=start)
+    if end is not None:
+        results = results.filter(day__lte=end)
+    return results
+
+
+HISTORICO_OUTPUTS = ("wide", "long", "parquet", "arrow")
+
+
+def historico_params(request, back_days=None):
+    """Read the window, levels and output of the historico report from the query parameters.
+
+    Args:
+        request: Request with the optional query parameters back_days, from
+            and to, inclusive dates, nivel, comma separated tipologias, and
+            output, one of HISTORICO_OUTPUTS.
+        back_days (int, optional): Overrides the back_days query parameter.
+            Defaults to 3.
+
+    Returns:
+        dict: max_days, days (the dates of a from/to window, else None),
+            start, end, levels and output.
+    """
+    if back_days is None:
+        back_days = request.query_params.get("back_days") or 3
+        try:
+            back_days = int(back_days)
+        except ValueError:
+            raise ValidationError({"back_days": "Expected a number of days"})
+    if not 0 < back_days <= HISTORICO_MAX_DAYS:
+        raise ValidationError(
+            {"back_days": f"Expected between 1 and {HISTORICO_MAX_DAYS} days"}
+        )
+
+    start = _date_param(request, "from")
+    end = _date_param(request, "to")
+    days = None
+    if start is not None or end is not None:
+        end = end or current_day()
+        start = start or end - timedelta(days=back_days - 1)
+        if start > end:
+            raise ValidationError({"from": "Expected a date before to"})
+        if (end - start).days >= HISTORICO_MAX_DAYS:
+            raise ValidationError(
+                {"from": f"Expected a window of at most {HISTORICO_MAX_DAYS} days"}
+            )
+        days = historico_days(start, end)
+
+    levels = LEVELS
+    nivel = request.query_params.get("nivel")
+    if nivel:
+        names = {name.strip().lower() for name in nivel.split(",")}
+        levels = tuple(level for level in LEVELS if level[1].lower() in names)
+        if len(levels) != len(names):
+            raise ValidationError(
+                {"nivel": f"Expected some of {', '.join(label for _, label in LEVELS)}"}
+            )
+
+    output = request.query_params.get("output") or "wide"
+    if output not in HISTORICO_OUTPUTS:
+        raise ValidationError({"output": f"Expected one of {', '.join(HISTORICO_OUTPUTS)}"})
+
+    return {
+        "max_days": len(days) if days is not None else back_days,
+        "days": days,
+        "start": start,
+        "end": end,
+        "levels": levels,
+        "output": output,
+    }
 
 
 class ColegioViewSet(viewsets.ModelViewSet):
@@ -151,9 +268,10 @@ class ColegioViewSet(viewsets.ModelViewSet):
     API endpoint that allows Colegios to be created, viewed or edited.
     """
 
-    queryset = Colegio.objects.all().order_by("cid")
+    queryset = Colegio.objects.select_related("pri_sid", "sec_sid", "pro_sid").order_by("cid")
     serializer_class = ColegioSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ColegioCursorPagination
 
     def create(self, request, *args, **kwargs):
         """This method is used to create a new Colegio object.
@@ -186,15 +304,21 @@ class ColegioViewSet(viewsets.ModelViewSet):
             "pro_sid": pro_sid,
         }
 
-        pri_encuesta = (
-            update_encuesta_by_sid(pri_sid, check_results=False) if pri_sid else None
-        )
-        sec_encuesta = (
-            update_encuesta_by_sid(sec_sid, check_results=False) if sec_sid else None
-        )
-        pro_encuesta = (
-            update_encuesta_by_sid(pro_sid, check_results=False) if pro_sid else None
-        )
+        # Fetch the encuestas concurrently, each distinct sid once
+        sids = [pri_sid, sec_sid, pro_sid]
+        encuestas = fetch_encuestas(sids)
+        missing = [sid for sid in sids if sid and sid not in encuestas]
+        if missing:
+            return JsonResponse(
+                {
+                    "error": "Error al actualizar o crear las encuestas",
+                    "detalle": missing,
+                },
+                status=500,
+            )
+        pri_encuesta = encuestas.get(pri_sid)
+        sec_encuesta = encuestas.get(sec_sid)
+        pro_encuesta = encuestas.get(pro_sid)
         try:
             # Se realiza la petición POST al servicio externo
             Colegio.objects.update_or_create(
@@ -221,10 +345,17 @@ class ColegioViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=["get"])
     def update_encuestas_results(self, request, *args, **kwargs):
+        """Queue an update of the Encuesta results, run by the run_jobs worker.
 
-        # call manage.py update_encuestas_results
-        result = os.popen("python manage.py update_encuestas_results").read()
-        return Response({"detail": "Encuestas results updated", "output": result})
+        Returns the job to follow at /jobs/{id}/. If an update is already
+        queued or running, that job is returned instead of queueing another.
+        Bad numeric parameters are answered with a 400 and nothing is queued.
+        """
+        validate_update_params(request)
+        job, created = enqueue(
+            "update_encuestas_results", payload=request.GET.dict(), dedupe=True
+        )
+        return job_response(job, created, request)
 
     @action(
         detail=False,
@@ -241,79 +372,26 @@ class ColegioViewSet(viewsets.ModelViewSet):
             _type_: _description_
 
         """
-        # serializer_class = FileUploadSerializer
         file = request.FILES.get("cocina_csv")
         if not file:
             return Response(
                 {"detail": "No file provided"}, status=status.HTTP_400_BAD_REQUEST
             )
         logging.debug(f"bulk_create_csv. file: {file}")
-        created_colegios = []
-        csv_file = StringIO(file.read().decode("utf-8"))
-        reader = csv.DictReader(csv_file)
-
-        for row in reader:
-            nombre = row["AN"]
-            comunidad_autonoma = row["CCAA"]
-            ssid = row["SSID"]
-            id_de_centro = row["ID DE CENTRO"]
-            url = row["URL"]
-            tipologia = row["TIPOLOGIA"]
-
-            cid, nivel = id_de_centro.split(" - ")
-
-            # remove all letter P, D and S contained in the string
-            cid = re.sub(r"[PDS]", "", cid)
-            if not all([cid, nombre, comunidad_autonoma, ssid, url, tipologia]):
-                return Response(
-                    {"detail": "Missing parameters for one or more colegios"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-
-            # Check if Colegio already exists
-            # if Colegio.objects.filter(cid=cid).exists():
-            #     logging.debug(f"bulk_create_csv. colegio {nombre} with cid {cid} already exists. Skipping")
-            #     continue
-
-            try:
-                # Create or update Encuesta. Also gets its results from LimeSurvey
-                # Check SIDs exist in database, if not, run UpdateEncuesta
-                encuesta = (
-                    update_encuesta_by_sid(ssid, check_results=False) if ssid else None
-                )
-            except Exception as e:
-                logging.error(f"Error updating encuesta for SSID {ssid}: {e}")
-                continue
-
-            # Create or update Colegio
-            try:
-                colegio = Colegio.objects.get(cid=cid)
-                colegio.nombre = nombre
-                colegio.comunidad_autonoma = comunidad_autonoma
-                colegio.telefono = colegio.telefono or ""
-                colegio.email = colegio.email or ""
-                colegio.pri_sid = encuesta if "Primaria" in nivel else colegio.pri_sid
-                colegio.sec_sid = encuesta if "Secundaria" in nivel else colegio.sec_sid
-                colegio.pro_sid = (
-                    encuesta if "Profesorado" in nivel else colegio.pro_sid
-                )
-                colegio.save()
-                created = False
-            except Colegio.DoesNotExist:
-                colegio, created = Colegio.objects.update_or_create(
-                    cid=cid,
-                    defaults={
-                        "nombre": nombre,
-                        "comunidad_autonoma": comunidad_autonoma,
-                        "telefono": "",
-                        "email": "",
-                        "pri_sid": encuesta if "Primaria" in nivel else None,
-                        "sec_sid": encuesta if "Secundaria" in nivel else None,
-                        "pro_sid": encuesta if "Profesorado" in nivel else None,
-                    },
-                )
-            logging.debug(f"bulk_create_csv. colegio {colegio} created")
-            created_colegios.append(colegio)
+        content = file.read().decode("utf-8")
+        try:
+            rows = parse_cocina_old(content)
+        except ValueError as ex:
+            return Response({"detail": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+        if _is_background(request):
+            job, created = enqueue("cocina_csv_old", payload={"content": content})
+            return job_response(job, created, request)
+
+        # Fetch every Encuesta once and concurrently, then the Colegios in bulk
+        encuestas = fetch_encuestas(
+            sid for row in rows for sid in row["sids"].values()
+        )
+        created_colegios = import_colegios(rows, encuestas, update_existing=True)
 
         serializer = ColegioSerializer(
             created_colegios, many=True, context={"request": request}
@@ -335,122 +413,27 @@ class ColegioViewSet(viewsets.ModelViewSet):
             _type_: _description_
 
         """
-        # Dictionary of words to translate
-        translations_dict = {
-            "ANDALUCIA": "ANDALUCÍA",
-            "CASTILLA LEON": "CASTILLA LEÓN",
-            "PAIS VASCO": "PAÍS VASCO",
-        }
-
         file = request.FILES.get("cocina_csv")
         if not file:
             return Response(
                 {"detail": "No file provided"}, status=status.HTTP_400_BAD_REQUEST
             )
         logging.debug(f"bulk_create_csv. file: {file}")
-        created_colegios = []
-        csv_file = StringIO(file.read().decode("utf-8"))
-        reader = csv.DictReader(csv_file)
-
-        for row in reader:
-            nombre = row["CENTRO"]
-            comunidad_autonoma = row["CA"]
-            # Apply translation if found in our dictionary
-            comunidad_autonoma = translations_dict.get(
-                comunidad_autonoma, comunidad_autonoma
-            )
-
-            cod_cid = row["Codigo interno"]
-            pri_url = row["PRIMARIA"]
-            sec_url = row["SECUNDARIA"]
-            pro_url = row["PROFESORADO"]
-
-            pri_sid = re.search(r"sid=(\d{6})", pri_url).group(1) if pri_url else None
-            sec_sid = re.search(r"sid=(\d{6})", sec_url).group(1) if sec_url else None
-            pro_sid = re.search(r"sid=(\d{6})", pro_url).group(1) if pro_url else None
-
-            # Extract the relevant part of the cod_cid and remove extra characters and whitespace
-            cid_match = re.search(r"L2A[D]?\d{3}", cod_cid)
-            if cid_match:
-                cid = cid_match.group(0).replace("D", "")
-            else:
-                cid = cod_cid.strip()
-
-            sec_sid = re.sub(r"[PDS]", "", sec_sid) if sec_sid else sec_sid
-            pro_sid = re.sub(r"[PDS]", "", pro_sid) if pro_sid else pro_sid
-
-            if not all(
-                [
-                    nombre,
-                    comunidad_autonoma,
-                    pri_sid,
-                    pri_url,
-                    sec_sid,
-                    sec_url,
-                    pro_sid,
-                    pro_url,
-                ]
-            ):
-                return Response(
-                    {"detail": "Missing parameters for one or more colegios"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-
-            # Check if Colegio already exists
-            if Colegio.objects.filter(cid=cid).exists():
-                logging.debug(
-                    f"bulk_create_csv. colegio {nombre} with cid {cid} already exists. Skipping"
-                )
-                continue
-
-            try:
-                pri_encuesta = (
-                    update_encuesta_by_sid(pri_sid, check_results=False)
-                    if pri_sid
-                    else None
-                )
-                sec_encuesta = (
-                    update_encuesta_by_sid(sec_sid, check_results=False)
-                    if sec_sid
-                    else None
-                )
-                pro_encuesta = (
-                    update_encuesta_by_sid(pro_sid, check_results=False)
-                    if pro_sid
-                    else None
-                )
-            except Exception as e:
-                logging.error(
-                    f"Error updating encuesta for Colegio {nombre} with cid {cid}. Error: {e}"
-                )
-                continue
-
-            try:
-                colegio = Colegio.objects.get(cid=cid)
-                colegio.nombre = nombre
-                colegio.comunidad_autonoma = comunidad_autonoma
-                colegio.telefono = colegio.telefono or ""
-                colegio.email = colegio.email or ""
-                colegio.pri_sid = pri_encuesta
-                colegio.sec_sid = sec_encuesta
-                colegio.pro_sid = pro_encuesta
-                colegio.save()
-                created = False
-            except Colegio.DoesNotExist:
-                colegio, created = Colegio.objects.update_or_create(
-                    cid=cid,
-                    defaults={
-                        "nombre": nombre,
-                        "comunidad_autonoma": comunidad_autonoma,
-                        "telefono": "",
-                        "email": "",
-                        "pri_sid": pri_encuesta,
-                        "sec_sid": sec_encuesta,
-                        "pro_sid": pro_encuesta,
-                    },
-                )
-            logging.debug(f"bulk_create_csv. colegio {colegio} created")
-            created_colegios.append(colegio)
+        content = file.read().decode("utf-8")
+        try:
+            rows = parse_cocina_new(content)
+        except ValueError as ex:
+            return Response({"detail": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+        if _is_background(request):
+            job, created = enqueue("cocina_csv_new", payload={"content": content})
+            return job_response(job, created, request)
+
+        # Colegios already stored are skipped, so their encuestas are not fetched
+        rows = exclude_existing_colegios(rows)
+        encuestas = fetch_encuestas(
+            sid for row in rows for sid in row["sids"].values()
+        )
+        created_colegios = import_colegios(rows, encuestas, update_existing=False)
 
         serializer = ColegioSerializer(
             created_colegios, many=True, context={"request": request}
@@ -458,804 +441,436 @@ class ColegioViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=False, methods=["get"])
-    def generate_csv_completitud_by_comunidad(self, request, *args, **kwargs):
-        """Generate a CSV file from data stored in the database, grouped by comunidad autónoma."""
-        # Subqueries for the latest 'encuestas_totales'
-        latest_pri_totales = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pri_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
-        latest_sec_totales = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("sec_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
-        latest_pro_totales = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pro_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
+    @cache_report
+    def generate_csv_completitud_by_comunidad(self, request, frame=None, *args, **kwargs):
+        """Generate a CSV file from data stored in the database, grouped by comunidad autónoma.
 
-        # Subqueries for the latest 'encuestas_cubiertas'
-        latest_pri_cubiertas = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pri_sid"))
-            .order_by("-date")
-            .values("encuestas_cubiertas")[:1]
-        )
-        latest_sec_cubiertas = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("sec_sid"))
-            .order_by("-date")
-            .values("encuestas_cubiertas")[:1]
-        )
-        latest_pro_cubiertas = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pro_sid"))
-            .order_by("-date")
-            .values("encuestas_cubiertas")[:1]
-        )
+        ``frame`` can be passed in, as returned by load_report_frame(), to
+        build several reports from a single query.
+        """
+        if frame is None:
+            frame = load_report_frame()
+        header, rows = completitud_by_comunidad(frame)
+        rows = order_by_comunidad(header, rows)
+        return csv_response(header, rows, "completitud_by_comunidad.csv")
 
-        # Subqueries for the latest 'encuestas_incompletas'
-        latest_pri_incompletas = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pri_sid"))
-            .order_by("-date")
-            .values("encuestas_incompletas")[:1]
-        )
-        latest_sec_incompletas = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("sec_sid"))
-            .order_by("-date")
-            .values("encuestas_incompletas")[:1]
-        )
-        latest_pro_incompletas = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pro_sid"))
-            .order_by("-date")
-            .values("encuestas_incompletas")[:1]
-        )
+    @action(detail=False, methods=["get"])
+    @cache_report
+    def generate_csv_previstas_by_comunidad(self, request, frame=None, *args, **kwargs):
+        """Generate a CSV file from data stored in the database, grouped by comunidad autónoma.
 
-        # Annotate each Colegio with its most recent results per encuesta field.
-        colegios_qs = (
-            Colegio.objects.annotate(
-                pri_totales=Coalesce(
-                    Subquery(latest_pri_totales, output_field=IntegerField()), Value(0)
-                ),
-                sec_totales=Coalesce(
-                    Subquery(latest_sec_totales, output_field=IntegerField()), Value(0)
-                ),
-                pro_totales=Coalesce(
-                    Subquery(latest_pro_totales, output_field=IntegerField()), Value(0)
-                ),
-                pri_cubiertas=Coalesce(
-                    Subquery(latest_pri_cubiertas, output_field=IntegerField()),
-                    Value(0),
-                ),
-                sec_cubiertas=Coalesce(
-                    Subquery(latest_sec_cubiertas, output_field=IntegerField()),
-                    Value(0),
-                ),
-                pro_cubiertas=Coalesce(
-                    Subquery(latest_pro_cubiertas, output_field=IntegerField()),
-                    Value(0),
-                ),
-                pri_incompletas=Coalesce(
-                    Subquery(latest_pri_incompletas, output_field=IntegerField()),
-                    Value(0),
-                ),
-                sec_incompletas=Coalesce(
-                    Subquery(latest_sec_incompletas, output_field=IntegerField()),
-                    Value(0),
-                ),
-                pro_incompletas=Coalesce(
-                    Subquery(latest_pro_incompletas, output_field=IntegerField()),
-                    Value(0),
-                ),
-            )
-            .annotate(
-                # Sum the values from each encuesta relationship
-                encuestas_totales=F("pri_totales")
-                + F("sec_totales")
-                + F("pro_totales"),
-                encuestas_cubiertas=F("pri_cubiertas")
-                + F("sec_cubiertas")
-                + F("pro_cubiertas"),
-                encuestas_incompletas=F("pri_incompletas")
-                + F("sec_incompletas")
-                + F("pro_incompletas"),
-            )
-            .annotate(
-                # Calculate percentage safely
-                porcentaje=Case(
-                    When(encuestas_totales=0, then=Value(0.0)),
-                    default=ExpressionWrapper(
-                        F("encuestas_cubiertas") * 100.0 / F("encuestas_totales"),
-                        output_field=FloatField(),
-                    ),
-                    output_field=FloatField(),
-                )
+        ``frame`` can be passed in, as returned by load_report_frame(), to
+        build several reports from a single query.
+        """
+        if frame is None:
+            frame = load_report_frame()
+        header, rows = previstas_by_comunidad(frame)
+        rows = order_by_comunidad(header, rows)
+        return csv_response(header, rows, "previstas_by_comunidad.csv")
+
+    @action(detail=False, methods=["get"])
+    @cache_report
+    def generate_csv_historico_by_encuesta(
+        self,
+        request,
+        back_days=None,
+        history=None,
+        *args,
+        **kwargs,
+    ):
+        """Generate a CSV file with historical data for each encuesta.
+
+        ``history`` can be passed in, as returned by load_historico() with at
+        least back_days results per encuesta, to build several CSVs from a
+        single query.
+
+        Otherwise the report is shaped by the query parameters read by
+        historico_params(): back_days results per encuesta (3 by default) or
+        the days between from and to, only the tipologias in nivel, and the
+        output, the "wide" CSV with a column pair per day, the "long" CSV
+        with a row per encuesta and day, or the long rows as a "parquet" or
+        "arrow" file.
+
+        With ?stream=1 a CSV is streamed while it is generated, chunk by
+        chunk, gzip compressed if ?gzip=1 is also given and the client accepts it.
+        """
+        # Get all colegios with their related encuestas
+        colegios = Colegio.objects.select_related("pri_sid", "sec_sid", "pro_sid")
+        if history is not None:
+            return csv_response(
+                historico_header(back_days),
+                historico_rows(colegios, history, back_days),
+                "historico_by_encuesta.csv",
             )
-        )
 
-        # Group the data by comunidad_autonoma.
-        colegios = (
-            colegios_qs.values("comunidad_autonoma")
-            .annotate(
-                total_centros=Count("id"),
-                encuestas_totales=Sum("encuestas_totales"),
-                encuestas_cubiertas=Sum("encuestas_cubiertas"),
-                encuestas_incompletas=Sum("encuestas_incompletas"),
+        params = historico_params(request, back_days)
+        max_days, days, levels = params["max_days"], params["days"], params["levels"]
+        if params["output"] == "wide":
+            header = historico_header(max_days, days)
+            filename = "historico_by_encuesta"
+
+            def rows(colegios, history):
+                return historico_rows(colegios, history, max_days, days, levels)
+
+        else:
+            header = HISTORICO_LONG_HEADER
+            filename = "historico_long_by_encuesta"
+
+            def rows(colegios, history):
+                return historico_long_rows(colegios, history, levels)
+
+        if params["output"] in ("parquet", "arrow"):
+            history = load_historico(max_days, start=params["start"], end=params["end"])
+            return columnar_response(
+                header, rows(colegios, history), filename, params["output"]
             )
-            .annotate(
-                porcentaje=Case(
-                    When(encuestas_totales=0, then=Value(0.0)),
-                    default=ExpressionWrapper(
-                        F("encuestas_cubiertas") * 100.0 / F("encuestas_totales"),
-                        output_field=FloatField(),
-                    ),
-                    output_field=FloatField(),
-                )
+
+        if request.GET.get("stream") in ("1", "true"):
+            chunks = iter_historico(
+                max_days, levels, start=params["start"], end=params["end"]
             )
-            .values(
-                "comunidad_autonoma",
-                "encuestas_totales",
-                "encuestas_cubiertas",
-                "encuestas_incompletas",
-                "porcentaje",
-                "total_centros",
+            return streaming_csv_response(
+                header,
+                (row for chunk in chunks for row in rows(*chunk)),
+                f"{filename}.csv",
+                gzip=request.GET.get("gzip") in ("1", "true")
+                and "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""),
             )
-        )
 
-        # Create the HttpResponse object with the appropriate CSV header.
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = (
-            'attachment; filename="completitud_by_comunidad.csv"'
-        )
+        history = load_historico(max_days, start=params["start"], end=params["end"])
+        return csv_response(header, rows(colegios, history), f"{filename}.csv")
 
-        writer = csv.writer(response)
-        # Write the header row
-        writer.writerow(
-            [
-                "comunidad",
-                "encuestas_totales",
-                "encuestas_cubiertas",
-                "encuestas_incompletas",
-                "porcentaje",
-                "total_centros",
-            ]
-        )
+    @action(detail=False, methods=["get"])
+    @cache_report
+    def generate_csv_tipologia_by_ccaa(self, request, frame=None, *args, **kwargs):
+        """Generate a CSV file from data stored in the database, grouped by comunidad autónoma and tipología.
 
-        # Initialize totals
-        total_encuestas_totales = 0
-        total_encuestas_cubiertas = 0
-        total_encuestas_incompletas = 0
-        total_total_centros = 0
-
-        # Write data rows
-        for colegio in colegios:
-            writer.writerow(
-                [
-                    colegio["comunidad_autonoma"],
-                    colegio["encuestas_totales"],
-                    colegio["encuestas_cubiertas"],
-                    colegio["encuestas_incompletas"],
-                    colegio["porcentaje"],
-                    colegio["total_centros"],
-                ]
-            )
-            # Accumulate totals
-            total_encuestas_totales += colegio["encuestas_totales"]
-            total_encuestas_cubiertas += colegio["encuestas_cubiertas"]
-            total_encuestas_incompletas += colegio["encuestas_incompletas"]
-            total_total_centros += colegio["total_centros"]
-
-        # Calculate total percentage
-        total_porcentaje = (
-            (total_encuestas_cubiertas * 100.0 / total_encuestas_totales)
-            if total_encuestas_totales > 0
-            else 0
-        )
+        ``frame`` can be passed in, as returned by load_report_frame(), to
+        build several reports from a single query.
+        """
+        if frame is None:
+            frame = load_report_frame()
+        header, rows = tipologia_by_comunidad(frame)
+        rows = order_by_comunidad(header, rows)
+        return csv_response(header, rows, "tipologia_by_comunidad.csv")
 
-        # Write totals row
-        writer.writerow(
-            [
-                "Totales",
-                total_encuestas_totales,
-                total_encuestas_cubiertas,
-                total_encuestas_incompletas,
-                total_porcentaje,
-                total_total_centros,
-            ]
-        )
-        response = update_ccaa_names_in_csv(
-            response, filename="completitud_by_comunidad.csv"
-        )
-        response = sort_csv_by_comunidad(
-            response, filename="completitud_by_comunidad.csv"
-        )
-        return response
+    @action(detail=False, methods=["get"])
+    @cache_report
+    def generate_csv_previstas_alumnado_by_comunidad(self, request, frame=None, *args, **kwargs):
+        """Generate a CSV file from data stored in the database, grouped by comunidad autónoma.
+
+        ``frame`` can be passed in, as returned by load_report_frame(), to
+        build several reports from a single query.
+        """
+        if frame is None:
+            frame = load_report_frame()
+        header, rows = previstas_alumnado_by_comunidad(frame)
+        rows = order_by_comunidad(header, rows)
+        return csv_response(header, rows, "previstas_alumno_by_comunidad.csv")
 
     @action(detail=False, methods=["get"])
-    def generate_csv_previstas_by_comunidad(self, request, *args, **kwargs):
-        """Generate a CSV file from data stored in the database, grouped by comunidad autónoma."""
-
-        # Subqueries to get the most recent EncuestaResult for each encuesta field
-        latest_pri = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pri_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
+    def update_only_csvs(self, request, *args, **kwargs):
+        """Queue the generation and upload of the CSV files without querying LimeSurvey or updating survey results."""
+        job, created = enqueue("update_only_csvs", dedupe=True)
+        return job_response(job, created, request)
 
-        latest_sec = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("sec_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
 
-        latest_pro = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pro_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that allows the status and progress of background jobs to be viewed.
+    """
 
-        # Annotate each Colegio with its latest results
-        colegios_qs = Colegio.objects.annotate(
-            pri_realizadas=Coalesce(
-                Subquery(latest_pri, output_field=IntegerField()), Value(0)
-            ),
-            sec_realizadas=Coalesce(
-                Subquery(latest_sec, output_field=IntegerField()), Value(0)
-            ),
-            pro_realizadas=Coalesce(
-                Subquery(latest_pro, output_field=IntegerField()), Value(0)
-            ),
-        ).annotate(
-            # Sum the latest results from the three related encuestas
-            realizadas=F("pri_realizadas")
-            + F("sec_realizadas")
-            + F("pro_realizadas")
-        )
+    queryset = Job.objects.all().order_by("-created_at")
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
-        # Group by comunidad_autonoma and aggregate over colegios
-        colegios = (
-            colegios_qs.values("comunidad_autonoma")
-            .annotate(centros_actuales=Count("id"), realizadas=Sum("realizadas"))
-            .values("comunidad_autonoma", "realizadas", "centros_actuales")
-        )
 
-        # Create the HttpResponse object with the appropriate CSV header.
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = (
-            'attachment; filename="previstas_by_comunidad.csv"'
-        )
+def job_response(job, created, request):
+    """Return the serialized job, 202 if it was just queued."""
+    serializer = JobSerializer(job, context={"request": request})
+    return Response(
+        serializer.data,
+        status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK,
+    )
 
-        writer = csv.writer(response)
-        # Write the header row
-        writer.writerow(
-            [
-                "CCAA",
-                "Previstas",
-                "Realizadas",
-                "Faltan",
-                "Porcentaje",
-                "Centros previstos",
-                "Centros actuales",
-                "Porcentaje1",
-            ]
-        )
 
-        # Initialize totals
-        total_previstas = 0
-        total_realizadas = 0
-        total_faltan = 0
-        total_centros_previstos = 0
-        total_centros_actuales = 0
-
-        # Write data rows
-        for colegio in colegios:
-            comunidad = colegio["comunidad_autonoma"]
-            previstas = PREVISTAS.get(comunidad, 0)
-            realizadas = colegio["realizadas"]
-            faltan = previstas - realizadas
-            porcentaje = (realizadas / previstas) * 100 if previstas > 0 else 0
-            centros_previstos = CENTROS_PREVISTOS.get(comunidad, 0)
-            centros_actuales = colegio["centros_actuales"]
-            porcentaje1 = (
-                (centros_actuales / centros_previstos) * 100
-                if centros_previstos > 0
-                else 0
-            )
+def _is_background(request):
+    value = request.query_params.get("background") or request.data.get("background")
+    return str(value).lower() in ("1", "true", "yes")
 
-            writer.writerow(
-                [
-                    comunidad,
-                    previstas,
-                    realizadas,
-                    faltan,
-                    f"{porcentaje:.2f}%",
-                    centros_previstos,
-                    centros_actuales,
-                    f"{porcentaje1:.2f}%",
-                ]
-            )
 
-            # Accumulate totals
-            total_previstas += previstas
-            total_realizadas += realizadas
-            total_faltan += faltan
-            total_centros_previstos += centros_previstos
-            total_centros_actuales += centros_actuales
+def publish_report(file_path, csv_data, publisher=None):
+    """Stage a report in the given publisher, or publish it on its own when there is none."""
+    if publisher is None:
+        publisher = get_publisher()
+        publisher.add(file_path, csv_data)
+        publisher.publish(f"[BOT] Update {os.path.basename(file_path)}")
+    else:
+        publisher.add(file_path, csv_data)
+
+
+# Stage timings published in last_update.csv, as <name>_seconds columns in
+# this order. Stages that did not run, such as harvest and store when only
+# the CSVs are updated, are left empty so the columns never change.
+LAST_UPDATE_STAGES = (
+    "harvest",
+    "store",
+    "load_report_frame",
+    "load_historico",
+    "update_csv_completitud_by_comunidad",
+    "update_csv_previstas_by_comunidad",
+    "update_csv_previstas_alumnado_by_comunidad",
+    "update_csv_tipologia_by_ccaa",
+    *(f"historico_{back_days}" for back_days in HISTORICO_BACK_DAYS),
+    "prepare_publish",
+    "reports",
+)
 
-        # Calculate total percentages
-        total_porcentaje = (
-            (total_realizadas / total_previstas) * 100 if total_previstas > 0 else 0
-        )
-        total_porcentaje1 = (
-            (total_centros_actuales / total_centros_previstos) * 100
-            if total_centros_previstos > 0
-            else 0
-        )
 
-        # Write totals row
-        writer.writerow(
-            [
-                "Totales",
-                total_previstas,
-                total_realizadas,
-                total_faltan,
-                f"{total_porcentaje:.2f}%",
-                total_centros_previstos,
-                total_centros_actuales,
-                f"{total_porcentaje1:.2f}%",
-            ]
-        )
-        response = update_ccaa_names_in_csv(
-            response, filename="previstas_by_comunidad.csv"
-        )
-        response = sort_csv_by_comunidad(
-            response, filename="previstas_by_comunidad.csv"
-        )
-        return response
+def publish_reports(request, start_time=None, metrics=None):
+    """Generate every report and publish them all in a single commit.
 
-    @action(detail=False, methods=["get"])
-    def generate_csv_historico_by_encuesta(
-        self,
-        request,
-        back_days=3,
-        *args,
-        **kwargs,
-    ):
-        """Generate a CSV file with historical data for each encuesta."""
-        # Get all colegios with their related encuestas
-        colegios = Colegio.objects.select_related("pri_sid", "sec_sid", "pro_sid")
+    Runs are serialized across processes: a call made while another run is
+    publishing waits for it and is skipped if a run started after the call
+    has completed meanwhile.
 
-        # Create the HttpResponse object with the appropriate CSV header.
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = (
-            'attachment; filename="historico_by_encuesta.csv"'
-        )
+    Args:
+        request: Request the reports are generated for.
+        start_time (datetime, optional): Start of the update, for the elapsed time in last_update.csv.
+        metrics (RunMetrics, optional): Metrics of the update the reports are
+            part of. The timings of its stages are added to last_update.csv
+            with those of the reports. Defaults to a run of its own.
+    """
+    ran, _ = run_exclusive(
+        "publish_reports", _publish_reports, request, start_time, metrics
+    )
+    if not ran:
+        logging.info("CSV files already published by a concurrent run")
+    return ran
 
-        writer = csv.writer(response)
-        # Write the header row based on back_days
-        header = [
-            "Centro",
-            "Tipologia",
-            "Id encuesta",
-            "Total Encuestas",
-            "Total Completas",
-            "Total Parciales",
-        ]
-        for i in range(back_days):
-            if i == 0:
-                header.append("Nuevas Completas Hoy")
-                header.append("Nuevas Parciales Hoy")
-            else:
-                header.append(f"Nuevas Completas D-{i}")
-                header.append(f"Nuevas Parciales D-{i}")
-        writer.writerow(header)
-
-        # Helper function to get the latest results for an encuesta
-        def get_latest_results(encuesta, days=3):
-            results = EncuestaResult.objects.filter(encuesta=encuesta).order_by(
-                "-date"
-            )[: days + 1]
-            return results
-
-        # Helper function to calculate differences
-        def calculate_differences(results, days=3):
-            differences = {"completas": [], "parciales": []}
-            for i in range(days):
-                if i < len(results):
-                    if i + 1 < len(results):
-                        completas_diff = (
-                            results[i].encuestas_cubiertas
-                            - results[i + 1].encuestas_cubiertas
-                        )
-                        parciales_diff = (
-                            results[i].encuestas_incompletas
-                            - results[i + 1].encuestas_incompletas
-                        )
-                    else:
-                        completas_diff = results[i].encuestas_cubiertas
-                        parciales_diff = results[i].encuestas_incompletas
-                else:
-                    completas_diff = ""
-                    parciales_diff = ""
-                differences["completas"].append(completas_diff)
-                differences["parciales"].append(parciales_diff)
-            return differences
-
-        # Write data rows
-        for colegio in colegios:
-            for encuesta in [colegio.pri_sid, colegio.sec_sid, colegio.pro_sid]:
-                if encuesta:
-                    results = get_latest_results(encuesta, days=back_days)
-                    if results:
-                        total_encuestas = results[0].encuestas_totales
-                        completas = results[0].encuestas_cubiertas
-                        parciales = results[0].encuestas_incompletas
-                        differences = calculate_differences(results, days=back_days)
-                        row = [
-                            colegio.nombre,
-                            (
-                                "Primaria"
-                                if encuesta == colegio.pri_sid
-                                else (
-                                    "Secundaria"
-                                    if encuesta == colegio.sec_sid
-                                    else "Profesorado"
-                                )
-                            ),
-                            encuesta.sid,
-                            total_encuestas,
-                            completas,
-                            parciales,
-                        ]
-                        for i in range(back_days):
-                            row.append(differences["completas"][i])
-                            row.append(differences["parciales"][i])
-                        writer.writerow(row)
-
-        return response
 
-    @action(detail=False, methods=["get"])
-    def generate_csv_tipologia_by_ccaa(self, request, *args, **kwargs):
-        """Generate a CSV file from data stored in the database, grouped by comunidad autónoma and tipología."""
-
-        # Subqueries to get the most recent EncuestaResult for each encuesta field
-        latest_pri = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pri_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
+def _run_stage(metrics, name, func, *args, **kwargs):
+    """Run a stage in a worker thread, returning (result, seconds taken).
 
-        latest_sec = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("sec_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
+    The stage is recorded in ``metrics`` under ``name``. Each worker thread
+    opens its own database connection, closed here so that it is not left
+    behind when the thread ends.
+    """
+    try:
+        with metrics.stage(name) as stage:
+            result = func(*args, **kwargs)
+        return result, stage["seconds"]
+    finally:
+        connections.close_all()
 
-        latest_pro = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pro_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
 
-        # Annotate each Colegio with its latest results
-        colegios_qs = Colegio.objects.annotate(
-            pri_realizadas=Coalesce(
-                Subquery(latest_pri, output_field=IntegerField()), Value(0)
-            ),
-            sec_realizadas=Coalesce(
-                Subquery(latest_sec, output_field=IntegerField()), Value(0)
-            ),
-            pro_realizadas=Coalesce(
-                Subquery(latest_pro, output_field=IntegerField()), Value(0)
-            ),
-        )
+def _publish_reports(request, start_time=None, metrics=None):
+    """Generate the reports in REPORT_WORKERS threads and publish them.
 
-        # Group by comunidad_autonoma and aggregate over colegios
-        colegios = (
-            colegios_qs.values("comunidad_autonoma")
-            .annotate(
-                total_primaria=Sum("pri_realizadas"),
-                total_secundaria=Sum("sec_realizadas"),
-                total_profesorado=Sum("pro_realizadas"),
-            )
-            .annotate(
-                total_conjunto=F("total_primaria")
-                + F("total_secundaria")
-                + F("total_profesorado")
-            )
-            .values(
-                "comunidad_autonoma",
-                "total_primaria",
-                "total_secundaria",
-                "total_profesorado",
-                "total_conjunto",
-            )
+    The two queries shared by the reports run concurrently, each report is
+    generated as soon as its data is loaded, and the publisher looks up what
+    is already published meanwhile, so the stage takes as long as its
+    slowest branch instead of the sum of the reports.
+    """
+    if metrics is None:
+        with RunMetrics("publish_reports") as metrics:
+            return _publish_reports(request, start_time, metrics)
+
+    publisher = get_publisher()
+    # Stages that ran before, in the order they ran
+    timings = {name: stage["seconds"] for name, stage in metrics.stages.items()}
+    stage_start = time.monotonic()
+    with ThreadPoolExecutor(
+        max_workers=REPORT_WORKERS, thread_name_prefix="reports"
+    ) as executor:
+        prepared = executor.submit(
+            _run_stage, metrics, "prepare_publish", publisher.prepare
         )
-
-        # Create the HttpResponse object with the appropriate CSV header.
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = (
-            'attachment; filename="tipologia_by_comunidad.csv"'
+        # Load the data shared by the reports once
+        frame_loaded = executor.submit(
+            _run_stage, metrics, "load_report_frame", load_report_frame
         )
-
-        writer = csv.writer(response)
-        # Write the header row
-        writer.writerow(
-            [
-                "CCAA",
-                "Realizadas Primaria",
-                "Realizadas Secundaria",
-                "Realizadas Profesorado",
-                "Realizadas Total",
-            ]
+        history_loaded = executor.submit(
+            _run_stage,
+            metrics,
+            "load_historico",
+            load_historico,
+            max(HISTORICO_BACK_DAYS),
         )
 
-        # Initialize totals
-        total_primaria = 0
-        total_secundaria = 0
-        total_profesorado = 0
-        total_conjunto = 0
-
-        # Write data rows
-        for colegio in colegios:
-            writer.writerow(
-                [
-                    colegio["comunidad_autonoma"],
-                    colegio["total_primaria"],
-                    colegio["total_secundaria"],
-                    colegio["total_profesorado"],
-                    colegio["total_conjunto"],
-                ]
+        reports = {}
+        frame, timings["load_report_frame"] = frame_loaded.result()
+        for report in (
+            update_csv_completitud_by_comunidad,
+            update_csv_previstas_by_comunidad,
+            update_csv_previstas_alumnado_by_comunidad,
+            update_csv_tipologia_by_ccaa,
+        ):
+            reports[report.__name__] = executor.submit(
+                _run_stage,
+                metrics,
+                report.__name__,
+                report,
+                request,
+                frame=frame,
+                publisher=publisher,
+            )
+        history, timings["load_historico"] = history_loaded.result()
+        for back_days in HISTORICO_BACK_DAYS:
+            reports[f"historico_{back_days}"] = executor.submit(
+                _run_stage,
+                metrics,
+                f"historico_{back_days}",
+                update_csv_historico_by_encuesta,
+                request,
+                back_days=back_days,
+                history=history,
+                publisher=publisher,
             )
-            # Accumulate totals
-            total_primaria += colegio["total_primaria"]
-            total_secundaria += colegio["total_secundaria"]
-            total_profesorado += colegio["total_profesorado"]
-            total_conjunto += colegio["total_conjunto"]
-
-        # Write totals row
-        writer.writerow(
-            [
-                "Totales",
-                total_primaria,
-                total_secundaria,
-                total_profesorado,
-                total_conjunto,
-            ]
-        )
 
-        response = update_ccaa_names_in_csv(
-            response, filename="tipologia_by_comunidad.csv"
-        )
-        response = sort_csv_by_comunidad(
-            response, filename="tipologia_by_comunidad.csv"
-        )
+        for name, report in reports.items():
+            _, timings[name] = report.result()
+        _, timings["prepare_publish"] = prepared.result()
+    timings["reports"] = round(time.monotonic() - stage_start, 3)
+    logging.info(f"_publish_reports. timings: {timings}")
 
-        return response
+    update_csv_datetime_last_update(
+        request, start_time=start_time, publisher=publisher, timings=timings
+    )
+    with metrics.stage("publish"):
+        publisher.publish("[BOT] Update report CSVs")
 
-    @action(detail=False, methods=["get"])
-    def generate_csv_previstas_alumnado_by_comunidad(self, request, *args, **kwargs):
-        """Generate a CSV file from data stored in the database, grouped by comunidad autónoma."""
-
-        # Subqueries to get the most recent EncuestaResult for each encuesta field
-        latest_pri = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("pri_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
 
-        latest_sec = (
-            EncuestaResult.objects.filter(encuesta=OuterRef("sec_sid"))
-            .order_by("-date")
-            .values("encuestas_totales")[:1]
-        )
+def _int_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: "Expected an integer"})
 
-        # Annotate each Colegio with its latest results
-        colegios_qs = Colegio.objects.annotate(
-            pri_realizadas=Coalesce(
-                Subquery(latest_pri, output_field=IntegerField()), Value(0)
-            ),
-            sec_realizadas=Coalesce(
-                Subquery(latest_sec, output_field=IntegerField()), Value(0)
-            ),
-        ).annotate(
-            # Sum the latest results from the three related encuestas
-            realizadas=F("pri_realizadas")
-            + F("sec_realizadas")
-        )
 
-        # Group by comunidad_autonoma and aggregate over colegios
-        colegios = (
-            colegios_qs.values("comunidad_autonoma")
-            .annotate(centros_actuales=Count("id"), realizadas=Sum("realizadas"))
-            .values("comunidad_autonoma", "realizadas", "centros_actuales")
-        )
+def _float_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValidationError({name: "Expected a number"})
 
-        # Create the HttpResponse object with the appropriate CSV header.
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = (
-            'attachment; filename="previstas_alumnado_by_comunidad.csv"'
-        )
 
-        writer = csv.writer(response)
-        # Write the header row
-        writer.writerow(
-            [
-                "CCAA",
-                "Previstas",
-                "Realizadas Alumnado",
-                "Faltan",
-                "Porcentaje",
-                "Centros previstos",
-                "Centros actuales",
-                "Porcentaje1",
-            ]
-        )
+# Numeric GET parameters of update_encuestas_results
+UPDATE_INT_PARAMS = ("flat_days", "max_interval", "concurrency", "retries")
+UPDATE_FLOAT_PARAMS = ("timeout",)
 
-        # Initialize totals
-        total_previstas = 0
-        total_realizadas = 0
-        total_faltan = 0
-        total_centros_previstos = 0
-        total_centros_actuales = 0
-
-        # Write data rows
-        for colegio in colegios:
-            comunidad = colegio["comunidad_autonoma"]
-            previstas = PREVISTAS.get(comunidad, 0)
-            realizadas = colegio["realizadas"]
-            faltan = previstas - realizadas
-            porcentaje = (realizadas / previstas) * 100 if previstas > 0 else 0
-            centros_previstos = CENTROS_PREVISTOS.get(comunidad, 0)
-            centros_actuales = colegio["centros_actuales"]
-            porcentaje1 = (
-                (centros_actuales / centros_previstos) * 100
-                if centros_previstos > 0
-                else 0
-            )
 
-            writer.writerow(
-                [
-                    comunidad,
-                    previstas,
-                    realizadas,
-                    faltan,
-                    f"{porcentaje:.2f}%",
-                    centros_previstos,
-                    centros_actuales,
-                    f"{porcentaje1:.2f}%",
-                ]
-            )
+def validate_update_params(request):
+    """Raise a ValidationError if a numeric parameter of update_encuestas_results is not a number."""
+    for name in UPDATE_INT_PARAMS:
+        _int_param(request, name)
+    for name in UPDATE_FLOAT_PARAMS:
+        _float_param(request, name)
 
-            # Accumulate totals
-            total_previstas += previstas
-            total_realizadas += realizadas
-            total_faltan += faltan
-            total_centros_previstos += centros_previstos
-            total_centros_actuales += centros_actuales
 
-        # Calculate total percentages
-        total_porcentaje = (
-            (total_realizadas / total_previstas) * 100 if total_previstas > 0 else 0
-        )
-        total_porcentaje1 = (
-            (total_centros_actuales / total_centros_previstos) * 100
-            if total_centros_previstos > 0
-            else 0
-        )
+@csrf_exempt
+@require_GET
+def update_encuestas_results(request, progress=None):
+    """Fetch the results of the encuestas from LimeSurvey, store them and publish the CSV files.
 
-        # Write totals row
-        writer.writerow(
-            [
-                "Totales",
-                total_previstas,
-                total_realizadas,
-                total_faltan,
-                f"{total_porcentaje:.2f}%",
-                total_centros_previstos,
-                total_centros_actuales,
-                f"{total_porcentaje1:.2f}%",
-            ]
-        )
-        response = update_ccaa_names_in_csv(
-            response, filename="previstas_alumno_by_comunidad.csv"
-        )
-        response = sort_csv_by_comunidad(
-            response, filename="previstas_alumno_by_comunidad.csv"
-        )
-        return response
+    Only one update runs at a time across processes. A call made while an
+    update is in flight waits for it and joins it instead of polling
+    LimeSurvey again.
 
-    @action(detail=False, methods=["get"])
-    def update_only_csvs(self, request, *args, **kwargs):
-        """Generate and update CSV files and upload them to GitHub without querying LimeSurvey or updating survey results."""
-        logging.info("Generating and updating CSV files to GitHub...")
-        start_time = datetime.now()
-        update_csv_completitud_by_comunidad(request)
-        update_csv_previstas_by_comunidad(request)
-        update_csv_previstas_alumnado_by_comunidad(request)
-        update_csv_historico_by_encuesta(request, back_days=3)
-        update_csv_historico_by_encuesta(request, back_days=10)
-        update_csv_historico_by_encuesta(request, back_days=30)
-        update_csv_tipologia_by_ccaa(request)
-        update_csv_datetime_last_update(request, start_time=start_time)
-
-        logging.info("Successfully generated and updated CSV files in GitHub")
-        return HttpResponse("CSV files updated successfully")
+    Args:
+        request: GET parameters mode, flat_days, max_interval, concurrency, timeout and retries.
+        progress (callable, optional): Called with a percent and a message as the update advances.
+    """
+    # Reject bad parameters with a 400 before taking the lock
+    try:
+        validate_update_params(request)
+    except ValidationError as ex:
+        return JsonResponse(ex.detail, status=400)
+
+    ran, response = run_exclusive(
+        "update_encuestas_results", _update_encuestas_results, request, progress
+    )
+    if not ran:
+        return HttpResponse("Encuesta results already updated by a concurrent run")
+    return response
 
 
-@csrf_exempt
-@require_GET
-def update_encuestas_results(request):
+def _update_encuestas_results(request, progress=None, metrics=None):
+    if metrics is None:
+        with RunMetrics("update_encuestas_results") as metrics:
+            return _update_encuestas_results(request, progress, metrics)
+
+    progress = progress or (lambda percent, message: None)
     # save current timestamp so later we can calculate how long it took to update the results
     start_time = datetime.now()
-    encuestas = Encuesta.objects.all()
+    encuestas = list(Encuesta.objects.all())
     logging.info(f"API_LIMESURVEY: {API_LIMESURVEY}")
     logging.info(f"INTERNAL_LS_USER: {INTERNAL_LS_USER}")
-    logging.info(f"INTERNAL_LS_PASS: {INTERNAL_LS_PASS}")
-
-    def update_encuesta(encuesta):
-        encuesta_sid = encuesta.sid
-        logging.info(f"Updating Encuesta results for {encuesta_sid}")
-        payload = {
-            "sid": encuesta_sid,
-            "usr": INTERNAL_LS_USER,
-            "pass": INTERNAL_LS_PASS,
-        }
-
-        try:
-            # Se realiza la petición POST al servicio externo
-            response = requests.post(API_LIMESURVEY, data=payload, verify=False)
-            logging.debug(f"UpdateEncuesta. response: {response}")
-            response.raise_for_status()  # Lanza excepción en caso de error HTTP
-            data_externa = response.json()  # Se decodifica la respuesta JSON
-            logging.debug(f"UpdateEncuesta. data_externa:{data_externa}")
-
-            # Fetch the Encuesta object
-            encuesta = Encuesta.objects.get(sid=encuesta_sid)
 
-            # Update or create the daily result
-            update_or_create_encuesta_result(encuesta, data_externa)
+    if request.GET.get("mode") == "incremental":
+        # Only poll surveys that can still change
+        encuestas, _ = select_encuestas_to_poll(
+            encuestas,
+            flat_days=_int_param(request, "flat_days"),
+            max_interval=_int_param(request, "max_interval"),
+        )
 
-        except requests.RequestException as ex:
-            logging.info(f"API_LIMESURVEY: {API_LIMESURVEY}")
-            logging.info(f"INTERNAL_LS_USER: {INTERNAL_LS_USER}")
-            logging.info(f"INTERNAL_LS_PASS: {INTERNAL_LS_PASS}")
-            logging.info(f"GITHUB_TOKEN: {GITHUB_TOKEN}")
-            logging.error(f"Error en la petición al servicio externo, {str(ex)}")
-        except ValueError as ex:
-            logging.error(f"Respuesta JSON inválida, {str(ex)}")
-        except Encuesta.DoesNotExist:
-            logging.error(f"Encuesta not found, {str(ex)}")
+    # Fetch every survey concurrently over a shared connection pool
+    progress(10, f"Fetching {len(encuestas)} encuestas")
+    with metrics.stage("harvest") as stage:
+        results = harvest_encuestas(
+            [encuesta.sid for encuesta in encuestas],
+            concurrency=_int_param(request, "concurrency"),
+            timeout=_float_param(request, "timeout"),
+            retries=_int_param(request, "retries"),
+            metrics=metrics,
+        )
+        stage["rows"] = len(results)
+
+    # Collect every fetched result so they can be written in one transaction
+    encuesta_results = []
+    for encuesta in encuestas:
+        data_externa = results.get(encuesta.sid)
+        if isinstance(data_externa, httpx.HTTPError):
+            logging.error(
+                f"Error en la petición al servicio externo para {encuesta.sid}, {str(data_externa)}"
+            )
+        elif isinstance(data_externa, ValueError):
+            logging.error(
+                f"Respuesta JSON inválida para {encuesta.sid}, {str(data_externa)}"
+            )
+        elif isinstance(data_externa, Exception):
+            logging.error(
+                f"Error actualizando resultados de {encuesta.sid}, {str(data_externa)}"
+            )
+        elif not isinstance(data_externa, dict):
+            # Valid JSON that is not an object, e.g. "Invalid session" or []
+            logging.error(
+                f"Respuesta inesperada del servicio externo para {encuesta.sid}, {data_externa!r}"
+            )
+        else:
+            encuesta_results.append((encuesta, data_externa))
 
-    # Use ThreadPoolExecutor to run tasks concurrently
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(update_encuesta, encuesta) for encuesta in encuestas]
-        concurrent.futures.wait(futures)
+    # Update or create the daily results
+    progress(70, f"Storing {len(encuesta_results)} results")
+    with metrics.stage("store") as stage:
+        stage["rows"] = bulk_upsert_encuesta_results(encuesta_results)
 
     logging.info("Successfully updated Encuesta results")
 
     # Generate and update CSV files
     logging.info("Generating and updating CSV files to GitHub...")
+    progress(85, "Publishing CSV files")
     factory = RequestFactory()
     request = factory.get("/")
 
-    from unicef.datamerge.views import (
-        update_csv_completitud_by_comunidad,
-        update_csv_previstas_by_comunidad,
-        update_csv_historico_by_encuesta,
-        update_csv_datetime_last_update,
-        update_csv_tipologia_by_ccaa,
-        update_csv_previstas_alumnado_by_comunidad,
-    )
-
-    update_csv_completitud_by_comunidad(request)
-    update_csv_previstas_by_comunidad(request)
-    update_csv_previstas_alumnado_by_comunidad(request)
-    update_csv_historico_by_encuesta(request, back_days=3)
-    update_csv_historico_by_encuesta(request, back_days=10)
-    update_csv_historico_by_encuesta(request, back_days=30)
-    update_csv_tipologia_by_ccaa(request)
-    update_csv_datetime_last_update(request, start_time)
+    publish_reports(request, start_time, metrics)
 
     logging.info("Successfully generated and updated CSV files in GitHub")
     return HttpResponse("Encuesta results and CSV files updated successfully")
@@ -1263,99 +878,98 @@ def update_encuestas_results(request):
 
 @csrf_exempt
 @require_GET
-def update_csv_completitud_by_comunidad(request):
+def update_csv_completitud_by_comunidad(request, frame=None, publisher=None):
 
-    response = ColegioViewSet().generate_csv_completitud_by_comunidad(request)
+    response = ColegioViewSet().generate_csv_completitud_by_comunidad(request, frame=frame)
 
     # Upload csv_data to github
     csv_data = response.getvalue()
     logging.debug(f"update_csv_completitud_by_comunidad. csv_data: {csv_data}")
-    push_to_gh_repo(
-        github_token=GITHUB_TOKEN,
-        csv_data=csv_data,
-        file_path="data/completitud_by_comunidad.csv",
-    )
+    publish_report("data/completitud_by_comunidad.csv", csv_data, publisher)
 
     return HttpResponse("completitud CSV updated successfully")
 
 
 @csrf_exempt
 @require_GET
-def update_csv_previstas_by_comunidad(request):
+def update_csv_previstas_by_comunidad(request, frame=None, publisher=None):
 
-    response = ColegioViewSet().generate_csv_previstas_by_comunidad(request)
+    response = ColegioViewSet().generate_csv_previstas_by_comunidad(request, frame=frame)
 
     # Upload csv_data to github
     csv_data = response.getvalue()
     logging.debug(f"update_csv_previstas_by_comunidad. csv_data: {csv_data}")
-    push_to_gh_repo(
-        github_token=GITHUB_TOKEN,
-        csv_data=csv_data,
-        file_path="data/previstas_by_comunidad.csv",
-    )
+    publish_report("data/previstas_by_comunidad.csv", csv_data, publisher)
 
     return HttpResponse("previstas CSV updated successfully")
 
 
 @csrf_exempt
 @require_GET
-def update_csv_previstas_alumnado_by_comunidad(request):
+def update_csv_previstas_alumnado_by_comunidad(request, frame=None, publisher=None):
 
-    response = ColegioViewSet().generate_csv_previstas_alumnado_by_comunidad(request)
+    response = ColegioViewSet().generate_csv_previstas_alumnado_by_comunidad(request, frame=frame)
 
     # Upload csv_data to github
     csv_data = response.getvalue()
     logging.debug(f"update_csv_previstas_alumnado_by_comunidad. csv_data: {csv_data}")
-    push_to_gh_repo(
-        github_token=GITHUB_TOKEN,
-        csv_data=csv_data,
-        file_path="data/previstas_alumno_by_comunidad.csv",
-    )
+    publish_report("data/previstas_alumno_by_comunidad.csv", csv_data, publisher)
 
     return HttpResponse("previstas alumnado CSV updated successfully")
 
 
 @csrf_exempt
 @require_GET
-def update_csv_historico_by_encuesta(request, back_days):
+def update_csv_historico_by_encuesta(
+    request, back_days=None, history=None, publisher=None
+):
+    try:
+        back_days = back_days or _int_param(request, "back_days") or 3
+        if not 0 < back_days <= HISTORICO_MAX_DAYS:
+            raise ValidationError(
+                {"back_days": f"Expected between 1 and {HISTORICO_MAX_DAYS} days"}
+            )
+    except ValidationError as ex:
+        return JsonResponse(ex.detail, status=400)
+    if history is None:
+        history = load_historico(back_days)
 
     response = ColegioViewSet().generate_csv_historico_by_encuesta(
-        request, back_days=back_days
+        request, back_days=back_days, history=history
     )
 
     # Upload csv_data to github
     csv_data = response.getvalue()
     logging.debug(f"update_csv_historico_by_encuesta. csv_data: {csv_data}")
-    push_to_gh_repo(
-        github_token=GITHUB_TOKEN,
-        csv_data=csv_data,
-        file_path=f"data/historico_{back_days}_by_encuesta.csv",
-    )
+    publish_report(f"data/historico_{back_days}_by_encuesta.csv", csv_data, publisher)
 
     return HttpResponse("historico CSV updated successfully")
 
 
 @csrf_exempt
 @require_GET
-def update_csv_tipologia_by_ccaa(request):
+def update_csv_tipologia_by_ccaa(request, frame=None, publisher=None):
 
-    response = ColegioViewSet().generate_csv_tipologia_by_ccaa(request)
+    response = ColegioViewSet().generate_csv_tipologia_by_ccaa(request, frame=frame)
 
     # Upload csv_data to github
     csv_data = response.getvalue()
     logging.debug(f"update_csv_tipologia_by_ccaa. csv_data: {csv_data}")
-    push_to_gh_repo(
-        github_token=GITHUB_TOKEN,
-        csv_data=csv_data,
-        file_path="data/tipologia_by_comunidad.csv",
-    )
+    publish_report("data/tipologia_by_comunidad.csv", csv_data, publisher)
 
     return HttpResponse("tipologia CSV updated successfully")
 
 
 @csrf_exempt
 @require_GET
-def update_csv_datetime_last_update(request, start_time=None):
+def update_csv_datetime_last_update(
+    request, start_time=None, publisher=None, timings=None
+):
+    """Publish last_update.csv with the time of the update and how long it took.
+
+    ``timings`` maps stage names to seconds. Every stage of LAST_UPDATE_STAGES
+    gets a <name>_seconds column, empty if it has no timing.
+    """
     if start_time:
         end_time = datetime.now()
         elapsed_time = end_time - start_time
@@ -1364,86 +978,104 @@ def update_csv_datetime_last_update(request, start_time=None):
     current_time = now.strftime("%Y-%m-%d %H:%M:%S")
     logging.debug(f"update_csv_datetime_last_update. current_time: {current_time}")
     # create simple csv with current time
-    csv_data = (
-        f"last_update,elapsed_time\n{current_time},{elapsed_time if start_time else ''}"
+    timings = timings or {}
+    header = ["last_update", "elapsed_time"]
+    values = [current_time, elapsed_time if start_time else ""]
+    for name in LAST_UPDATE_STAGES:
+        header.append(f"{name}_seconds")
+        values.append(timings.get(name, ""))
+    csv_data = ",".join(header) + "\n" + ",".join(str(value) for value in values)
+    publish_report("data/last_update.csv", csv_data, publisher)
+
+    return HttpResponse("last update CSV updated successfully")
+
+
+@require_GET
+def prometheus_metrics(request):
+    """Expose the reports of the last refresh runs in the Prometheus text format."""
+    return HttpResponse(
+        render_prometheus(load_run_reports()), content_type=PROMETHEUS_CONTENT_TYPE
     )
-    push_to_gh_repo(
-        github_token=GITHUB_TOKEN, csv_data=csv_data, file_path="data/last_update.csv"
+
+
+class Echo:
+    """File-like object that returns what is written, for csv.writer to produce lines."""
+
+    def write(self, value):
+        return value
+
+
+# Bytes of CSV gathered before a chunk is sent, or compressed, when streaming
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def _csv_blocks(header, rows):
+    writer = csv.writer(Echo())
+    block = [writer.writerow(header)]
+    size = len(block[0])
+    for row in rows:
+        line = writer.writerow(row)
+        block.append(line)
+        size += len(line)
+        if size >= STREAM_BLOCK_SIZE:
+            yield "".join(block).encode("utf-8")
+            block, size = [], 0
+    if block:
+        yield "".join(block).encode("utf-8")
+
+
+def _gzip_blocks(blocks):
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip container
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_csv_response(header, rows, filename, gzip=False):
+    """Stream the header and rows as a CSV while the rows are generated."""
+    blocks = _csv_blocks(header, rows)
+    response = StreamingHttpResponse(
+        _gzip_blocks(blocks) if gzip else blocks, content_type="text/csv"
     )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if gzip:
+        response["Content-Encoding"] = "gzip"
+    response["Vary"] = "Accept-Encoding"
+    return response
 
-    return HttpResponse("last update CSV updated successfully")
+
+# Content types of the columnar outputs, all written by pyarrow through pandas
+COLUMNAR_CONTENT_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
 
 
-def update_ccaa_names_in_csv(response, filename="colegios_data.csv"):
-    """Update the names in the CCAA column of given CSV based on a constant dictionary."""
-    # Get the CSV data from the generate_csv_previstas_by_comunidad method
-    csv_data = response.content.decode("utf-8")
-
-    # Read the CSV data
-    csv_file = io.StringIO(csv_data)
-    reader = csv.reader(csv_file)
-    rows = list(reader)
-
-    # Update the CCAA names
-    header = rows[0]
-    data_rows = rows[1:]
-    updated_rows = [header]
-
-    for row in data_rows:
-        comunidad = row[0]
-        updated_comunidad = CCAA_NAME_MAPPINGS.get(comunidad, comunidad)
-        row[0] = updated_comunidad
-        updated_rows.append(row)
-
-    # Create the HttpResponse object with the updated CSV data
-    updated_response = HttpResponse(content_type="text/csv")
-    updated_response["Content-Disposition"] = f"attachment; filename={filename}"
-
-    writer = csv.writer(updated_response)
-    writer.writerows(updated_rows)
-
-    return updated_response
-
-
-def sort_csv_by_comunidad(response, filename="sorted_colegios_data.csv"):
-    """Sort the rows of a CSV file alphabetically by the CCAA or comunidad_autonoma column."""
-    # Get the CSV data from the update_ccaa_names_in_csv method
-    csv_data = response.content.decode("utf-8")
-
-    # Read the CSV data
-    csv_file = io.StringIO(csv_data)
-    reader = csv.reader(csv_file)
-    rows = list(reader)
-
-    # Identify the column index for CCAA or comunidad
-    header = rows[0]
-    data_rows = rows[1:]
-    if "CCAA" in header:
-        sort_index = header.index("CCAA")
-    elif "comunidad" in header:
-        sort_index = header.index("comunidad")
-    elif "comunidad_autonoma" in header:
-        sort_index = header.index("comunidad_autonoma")
+def columnar_response(header, rows, filename, output):
+    """Serialize the header and rows as a Parquet or Arrow IPC file."""
+    frame = pd.DataFrame.from_records(list(rows), columns=header)
+    buffer = io.BytesIO()
+    if output == "parquet":
+        frame.to_parquet(buffer, index=False)
     else:
-        # If neither column is found, return the original response
-        return response
-
-    # Sort the data rows alphabetically by the identified column
-    sorted_data_rows = sorted(data_rows, key=lambda row: row[sort_index])
+        frame.to_feather(buffer)
+    response = HttpResponse(buffer.getvalue(), content_type=COLUMNAR_CONTENT_TYPES[output])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{output}"'
+    return response
 
-    # Move the last row to the top
-    if sorted_data_rows:
-        print("sorted_data_rows: ", sorted_data_rows)
-        last_row = sorted_data_rows.pop()
-        sorted_data_rows.insert(0, last_row)
-        print("sorted_data_rows: ", sorted_data_rows)
 
-    # Create the HttpResponse object with the sorted CSV data
-    sorted_response = HttpResponse(content_type="text/csv")
-    sorted_response["Content-Disposition"] = f"attachment; filename={filename}"
+def csv_response(header, rows, filename):
+    """Serialize the header and rows straight into a CSV HttpResponse."""
+    response = HttpResponse(content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
 
-    writer = csv.writer(sorted_response)
+    writer = csv.writer(response)
     writer.writerow(header)
-    writer.writerows(sorted_data_rows)
-
-    return sorted_response
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    record_rows(count)
+    return response
@@ -10,10 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
-import psycopg2
-from psycopg2 import OperationalError
-import logging
+from dotenv import load_dotenv
+from unicef.database import get_database_config
+
+# Cargar las variables de entorno desde el archivo .env
+load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -77,39 +80,24 @@ WSGI_APPLICATION = "unicef.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-def get_database_config():
-    try:
-        # Try to connect to the PostgreSQL database
-        conn = psycopg2.connect(
-            dbname="unicef",
-            user="postgres",
-            password="postgres",
-            host="10.10.10.115",
-            port="5432",
-            connect_timeout=5  # Set the timeout to 5 seconds
-        )
-        conn.close()
-        # If connection is successful, return PostgreSQL config
-        return {
-            "default": {
-                "ENGINE": "django.db.backends.postgresql",
-                "NAME": "unicef",
-                "USER": "postgres",
-                "PASSWORD": "postgres",
-                "HOST": "10.10.10.115",
-                "PORT": "5432",
-            }
+# Selected from DATABASE_URL or the DB_* variables, see unicef/database.py
+DATABASES = get_database_config(BASE_DIR)
+
+# Cache of the report endpoints, see unicef/datamerge/report_cache.py.
+# In-process by default; set CACHE_DIR to share it between processes.
+if os.getenv("CACHE_DIR"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.getenv("CACHE_DIR"),
         }
-    except OperationalError:
-        # If connection fails, return SQLite config
-        return {
-            "default": {
-                "ENGINE": "django.db.backends.sqlite3",
-                "NAME": BASE_DIR / "db.sqlite3",
-            }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
         }
-
-DATABASES = get_database_config()
+    }
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
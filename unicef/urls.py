@@ -24,6 +24,7 @@ from .datamerge import views
 router = routers.DefaultRouter()
 router.register(r"encuestas", views.EncuestaViewSet)
 router.register(r"colegios", views.ColegioViewSet)
+router.register(r"jobs", views.JobViewSet)
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -33,4 +34,5 @@ urlpatterns = [
     path("update_csv_previstas_by_comunidad/", views.update_csv_previstas_by_comunidad, name="update_csv_previstas_by_comunidad"),
     path("update_csv_historico_by_encuesta/", views.update_csv_historico_by_encuesta, name="update_csv_historico_by_encuesta"),
     path("update_csv_datetime_last_update/", views.update_csv_datetime_last_update, name="update_csv_datetime_last_update"),
+    path("metrics", views.prometheus_metrics, name="metrics"),
 ]